@@ -1,14 +1,118 @@
 import click
 import subprocess
+import sys
+from .scripts.cache import BuildCache, DEFAULT_CACHE_PATH, DEFAULT_MAX_SIZE_MB
+from .scripts.config import load_config
+from .scripts.fanout import DEFAULT_LOG_DIR, fanout_deploy
+from .scripts.journal import Journal, config_fingerprint
 from .scripts.new_stack import stack_automate
 from .scripts.lambdas import lambda_automate
+from .scripts.tracing import tracer
 
 
-@click.command()
+@click.group(invoke_without_command=True)
+@click.option('--file', help='Path of the package.json file.')
+@click.option('--jobs', type=int, default=None,
+              help='Number of lambda functions or stack resources to deploy concurrently.')
+@click.option('--no-cache', is_flag=True, help='Rebuild every lambda package from scratch.')
+@click.option('--trace', default=None,
+              help='Write a Chrome trace of every phase and AWS call to this file and print the slowest ones.')
+@click.option('--resume', is_flag=True, help='Continue the last run from the first step it did not finish.')
+@click.pass_context
+def master_command(ctx, file='', jobs=None, no_cache=False, trace=None, resume=False):
+    if trace:
+        tracer.reset(enabled=True)
+        ctx.call_on_close(lambda: _write_trace(trace))
+
+    if ctx.invoked_subcommand:
+        return
+
+    if not file:
+        file = click.prompt('Provide the path of package.json file')
+
+    data = load_config(file)
+    journal = Journal.from_config(data)
+    if resume:
+        if not journal.resume(config_fingerprint(data)):
+            return
+    else:
+        journal.start(config_fingerprint(data))
+
+    if 'lambdas' not in journal.completed:
+        lambda_automate(data, jobs=jobs, use_cache=not no_cache)
+        journal.record('lambdas')
+    stack_automate(data, jobs=jobs, journal=journal)
+    journal.finish()
+
+
+def _write_trace(path):
+    tracer.print_summary()
+    tracer.write_chrome_trace(path)
+    print('Trace written to {}, open it in chrome://tracing or Perfetto.'.format(path))
+
+
+@master_command.command()
+@click.option('--file', prompt='Provide the path of package.json file')
+def plan(file):
+    """Show what apply would create or update without changing anything."""
+    data = load_config(file)
+    lambda_automate(data, plan_only=True)
+    stack_automate(data, plan_only=True)
+
+
+@master_command.command()
 @click.option('--file', prompt='Provide the path of package.json file')
-def master_command(file=''):
-    lambda_automate(file)
-    stack_automate(file)
+@click.option('--jobs', type=int, default=None,
+              help='Number of lambda functions or stack resources to deploy concurrently.')
+@click.option('--no-cache', is_flag=True, help='Rebuild every lambda package from scratch.')
+def apply(file, jobs, no_cache):
+    """Deploy only what differs from the resources that already exist."""
+    data = load_config(file)
+    lambda_automate(data, jobs=jobs, use_cache=not no_cache)
+    stack_automate(data, jobs=jobs, apply=True)
+
+
+@master_command.command()
+@click.option('--file', prompt='Provide the path of package.json file')
+def validate(file):
+    """Check package.json without calling AWS."""
+    load_config(file)
+    print('Setting file is valid.')
+
+
+@master_command.command()
+@click.option('--file', prompt='Provide the path of package.json file')
+@click.option('--target', 'names', multiple=True, help='Only deploy to this target, can be repeated.')
+@click.option('--workers', type=int, default=None,
+              help='Number of targets to deploy concurrently, all of them by default.')
+@click.option('--jobs', type=int, default=None,
+              help='Number of lambda functions or stack resources to deploy concurrently in each target.')
+@click.option('--no-cache', is_flag=True, help='Rebuild every lambda package from scratch.')
+@click.option('--apply', 'apply_only', is_flag=True, help='Deploy only what differs in each target.')
+@click.option('--log-dir', default=DEFAULT_LOG_DIR, help='Directory of the per target log files.')
+@click.option('--resume', is_flag=True, help='Continue every target from the first step its last run did not finish.')
+def fanout(file, names, workers, jobs, no_cache, apply_only, log_dir, resume):
+    """Deploy to every region and account listed in targets at the same time."""
+    data = load_config(file)
+    outcomes = fanout_deploy(data, names=names, workers=workers, jobs=jobs, use_cache=not no_cache,
+                             apply=apply_only, log_dir=log_dir, resume=resume)
+    if not outcomes or any(error for target, results, error, seconds in outcomes):
+        sys.exit(1)
+
+
+@master_command.group()
+def cache():
+    """Manage the local lambda package cache."""
+
+
+@cache.command()
+@click.option('--path', default=DEFAULT_CACHE_PATH, help='Cache directory.')
+@click.option('--max-size', type=float, default=DEFAULT_MAX_SIZE_MB,
+              help='Size in MB to shrink the cache to, 0 empties it.')
+def prune(path, max_size):
+    """Evict least recently used packages until the cache fits in --max-size."""
+    removed, remaining = BuildCache(path=path).prune(max_size=int(max_size * 1024 * 1024))
+    print('Removed {} cached packages, {:.1f} MB left.'.format(removed, remaining / 1024.0 / 1024.0))
 
 if __name__ == '__main__':
-    master_command()
\ No newline at end of file
+    master_command()
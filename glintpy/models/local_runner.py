@@ -0,0 +1,396 @@
+import copy
+import fnmatch
+import re
+import threading
+import time
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
+from functools import lru_cache
+
+SUCCEEDED = 'SUCCEEDED'
+FAILED = 'FAILED'
+
+DEFAULT_MAX_STEPS = 25000
+
+StateTiming = namedtuple('StateTiming', ['name', 'type', 'seconds', 'virtual_seconds'])
+
+
+class TaskError(Exception):
+    def __init__(self, error, cause=''):
+        super().__init__(cause or error)
+        self.error = error
+        self.cause = cause
+
+
+class ExecutionRuntimeError(Exception):
+    # a problem with the definition or its paths, which Retry and Catch do not handle
+    pass
+
+
+class _Failure(Exception):
+    def __init__(self, error, cause=''):
+        super().__init__(error)
+        self.error = error
+        self.cause = cause
+
+
+class VirtualClock(object):
+    def __init__(self, start=None):
+        self.start = start or datetime.now(timezone.utc)
+        self.elapsed = 0.0
+
+    def now(self):
+        return self.start + timedelta(seconds=self.elapsed)
+
+    def sleep(self, seconds):
+        self.elapsed += max(seconds, 0)
+
+    def fork(self):
+        clock = VirtualClock(self.start)
+        clock.elapsed = self.elapsed
+        return clock
+
+
+class Execution(object):
+    def __init__(self, status, output=None, error=None, cause=None, timings=None, virtual_seconds=0.0,
+                 seconds=0.0):
+        self.status = status
+        self.output = output
+        self.error = error
+        self.cause = cause
+        self.timings = timings or []
+        self.virtual_seconds = virtual_seconds
+        self.seconds = seconds
+
+    def __repr__(self):
+        return '<Execution {} {}>'.format(self.status, self.error or '')
+
+
+@lru_cache(maxsize=1024)
+def _parse_path(path):
+    if path == '$':
+        return ()
+    if not path.startswith('$'):
+        raise ExecutionRuntimeError('Invalid path {}'.format(path))
+    tokens = []
+    for name, index in re.findall(r"\.([^.\[\]]+)|\[(\d+)\]", path[1:]):
+        tokens.append(int(index) if index else name)
+    return tuple(tokens)
+
+
+def get_path(data, path):
+    for token in _parse_path(path):
+        try:
+            data = data[token]
+        except (KeyError, IndexError, TypeError):
+            raise ExecutionRuntimeError('Path {} not found in the state input'.format(path))
+    return data
+
+
+def _has_path(data, path):
+    try:
+        get_path(data, path)
+        return True
+    except ExecutionRuntimeError:
+        return False
+
+
+def set_path(data, path, value):
+    tokens = _parse_path(path)
+    if not tokens:
+        return value
+    root = copy.copy(data) if isinstance(data, (dict, list)) else {}
+    node = root
+    for token in tokens[:-1]:
+        child = node.get(token) if isinstance(node, dict) else node[token]
+        child = copy.copy(child) if isinstance(child, (dict, list)) else {}
+        node[token] = child
+        node = child
+    node[tokens[-1]] = value
+    return root
+
+
+def _parameters(template, data):
+    # keys ending in .$ take their value from the input
+    if isinstance(template, dict):
+        return {key[:-2] if key.endswith('.$') else key:
+                get_path(data, value) if key.endswith('.$') else _parameters(value, data)
+                for key, value in template.items()}
+    if isinstance(template, list):
+        return [_parameters(item, data) for item in template]
+    return template
+
+
+def _timestamp(value):
+    return datetime.fromisoformat(value.replace('Z', '+00:00'))
+
+
+def _is_number(value):
+    return isinstance(value, (int, float)) and not isinstance(value, bool)
+
+
+def _is_timestamp(value):
+    try:
+        return isinstance(value, str) and bool(_timestamp(value))
+    except ValueError:
+        return False
+
+
+COMPARISONS = {'Equals': lambda a, b: a == b,
+               'LessThan': lambda a, b: a < b,
+               'GreaterThan': lambda a, b: a > b,
+               'LessThanEquals': lambda a, b: a <= b,
+               'GreaterThanEquals': lambda a, b: a >= b}
+KINDS = {'String': (lambda v: isinstance(v, str), lambda v: v),
+         'Numeric': (_is_number, lambda v: v),
+         'Boolean': (lambda v: isinstance(v, bool), lambda v: v),
+         'Timestamp': (_is_timestamp, _timestamp)}
+TYPE_TESTS = {'IsNull': lambda v: v is None,
+              'IsString': lambda v: isinstance(v, str),
+              'IsNumeric': _is_number,
+              'IsBoolean': lambda v: isinstance(v, bool),
+              'IsTimestamp': _is_timestamp}
+
+
+def evaluate_rule(rule, data):
+    if 'And' in rule:
+        return all(evaluate_rule(item, data) for item in rule['And'])
+    if 'Or' in rule:
+        return any(evaluate_rule(item, data) for item in rule['Or'])
+    if 'Not' in rule:
+        return not evaluate_rule(rule['Not'], data)
+
+    variable = rule.get('Variable')
+    for operator, expected in rule.items():
+        if operator in ('Variable', 'Next'):
+            continue
+        if operator == 'IsPresent':
+            return _has_path(data, variable) == expected
+        if not _has_path(data, variable):
+            return False
+        value = get_path(data, variable)
+        if operator in TYPE_TESTS:
+            return TYPE_TESTS[operator](value) == expected
+        if operator == 'StringMatches':
+            return isinstance(value, str) and fnmatch.fnmatchcase(value, expected)
+        if operator.endswith('Path'):
+            operator, expected = operator[:-4], get_path(data, expected)
+        for kind, (check, convert) in KINDS.items():
+            if operator.startswith(kind) and operator[len(kind):] in COMPARISONS:
+                if not check(value) or not check(expected):
+                    return False
+                return COMPARISONS[operator[len(kind):]](convert(value), convert(expected))
+        raise ExecutionRuntimeError('Unsupported choice operator {}'.format(operator))
+    raise ExecutionRuntimeError('Choice rule without an operator')
+
+
+def _matches(error_equals, error):
+    return error in error_equals or 'States.ALL' in error_equals or \
+        ('States.TaskFailed' in error_equals and not error.startswith('States.'))
+
+
+class LocalRunner(object):
+    # resources maps each Task Resource ARN to a callable taking the effective input
+    def __init__(self, machine, resources=None, max_workers=8, max_steps=DEFAULT_MAX_STEPS):
+        self.definition = machine.to_dict() if hasattr(machine, 'to_dict') else machine
+        self.resources = dict(resources or {})
+        self.max_steps = max_steps
+        self._pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='glint-sfn')
+        self._free_workers = threading.Semaphore(max_workers)
+
+    def register(self, resource):
+        def decorator(fn):
+            self.resources[resource] = fn
+            return fn
+        return decorator
+
+    def close(self):
+        self._pool.shutdown()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def run(self, data=None, clock=None):
+        clock = clock or VirtualClock()
+        timings = []
+        started = time.perf_counter()
+        try:
+            output = self._run_graph(self.definition, {} if data is None else data, clock, timings)
+            execution = Execution(SUCCEEDED, output=output)
+        except _Failure as e:
+            execution = Execution(FAILED, error=e.error, cause=e.cause)
+        except ExecutionRuntimeError as e:
+            execution = Execution(FAILED, error='States.Runtime', cause=str(e))
+        execution.timings = timings
+        execution.virtual_seconds = clock.elapsed
+        execution.seconds = time.perf_counter() - started
+        return execution
+
+    def run_many(self, inputs, workers=8):
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            return list(pool.map(self.run, inputs))
+
+    def _run_graph(self, graph, data, clock, timings):
+        states = graph.get('States', {})
+        name = graph.get('StartAt')
+        for step in range(self.max_steps):
+            if name not in states:
+                raise ExecutionRuntimeError('State {} is not defined'.format(name))
+            state = states[name]
+            kind = state.get('Type')
+            started, waited = time.perf_counter(), clock.elapsed
+            try:
+                data, next_name = self._run_state(name, state, data, clock, timings)
+            finally:
+                timings.append(StateTiming(name, kind, time.perf_counter() - started, clock.elapsed - waited))
+            if next_name is None:
+                return data
+            name = next_name
+        raise ExecutionRuntimeError('Execution exceeded {} state transitions'.format(self.max_steps))
+
+    def _run_state(self, name, state, data, clock, timings):
+        kind = state.get('Type')
+        if kind == 'Succeed':
+            return self._output(state, self._input(state, data)), None
+        if kind == 'Fail':
+            raise _Failure(state.get('Error', 'States.Fail'), state.get('Cause', ''))
+        if kind == 'Choice':
+            effective = self._input(state, data)
+            for rule in state.get('Choices', []):
+                if evaluate_rule(rule, effective):
+                    return self._output(state, effective), rule.get('Next')
+            if state.get('Default'):
+                return self._output(state, effective), state.get('Default')
+            raise _Failure('States.NoChoiceMatched', 'No choice rule matched in {}'.format(name))
+
+        effective = self._input(state, data)
+        if 'Parameters' in state:
+            effective = _parameters(state.get('Parameters'), effective)
+
+        if kind == 'Pass':
+            result = state.get('Result', effective)
+        elif kind == 'Wait':
+            self._wait(state, effective, clock)
+            result = effective
+        elif kind in ('Task', 'Parallel'):
+            try:
+                result = self._attempt(state, effective, clock, timings)
+            except _Failure as e:
+                for catcher in state.get('Catch', []):
+                    if _matches(catcher.get('ErrorEquals', []), e.error):
+                        error_output = {'Error': e.error, 'Cause': e.cause}
+                        return set_path(data, catcher.get('ResultPath', '$'), error_output), catcher.get('Next')
+                raise
+        else:
+            raise ExecutionRuntimeError('Unsupported state type {} in {}'.format(kind, name))
+
+        if kind == 'Wait':
+            output = result
+        elif 'ResultPath' in state and state.get('ResultPath') is None:
+            output = data
+        else:
+            output = set_path(data, state.get('ResultPath', '$'), result)
+        return self._output(state, output), None if state.get('End') else state.get('Next')
+
+    def _input(self, state, data):
+        if 'InputPath' in state:
+            return {} if state.get('InputPath') is None else get_path(data, state.get('InputPath'))
+        return data
+
+    def _output(self, state, data):
+        if 'OutputPath' in state:
+            return {} if state.get('OutputPath') is None else get_path(data, state.get('OutputPath'))
+        return data
+
+    def _wait(self, state, data, clock):
+        if 'Seconds' in state:
+            clock.sleep(state.get('Seconds'))
+        elif 'SecondsPath' in state:
+            clock.sleep(get_path(data, state.get('SecondsPath')))
+        else:
+            timestamp = state.get('Timestamp') or get_path(data, state.get('TimestampPath'))
+            clock.sleep((_timestamp(timestamp) - clock.now()).total_seconds())
+
+    def _attempt(self, state, data, clock, timings):
+        attempts = {}
+        while True:
+            try:
+                if state.get('Type') == 'Parallel':
+                    return self._run_branches(state, data, clock, timings)
+                return self._invoke(state, data)
+            except _Failure as e:
+                retrier = next((index for index, item in enumerate(state.get('Retry', []))
+                                if _matches(item.get('ErrorEquals', []), e.error)), None)
+                if retrier is None:
+                    raise
+                settings = state['Retry'][retrier]
+                count = attempts.get(retrier, 0)
+                if count >= settings.get('MaxAttempts', 3):
+                    raise
+                attempts[retrier] = count + 1
+                clock.sleep(settings.get('IntervalSeconds', 1) * settings.get('BackoffRate', 2.0) ** count)
+
+    def _invoke(self, state, data):
+        resource = state.get('Resource')
+        if resource not in self.resources:
+            raise ExecutionRuntimeError('No callable registered for resource {}'.format(resource))
+        try:
+            return self.resources[resource](data)
+        except TaskError as e:
+            raise _Failure(e.error, e.cause)
+        except Exception as e:
+            raise _Failure(e.__class__.__name__, str(e))
+
+    def _run_branch(self, branch, data, clock):
+        timings = []
+        return self._run_graph(branch, data, clock, timings), timings
+
+    def _run_branches(self, state, data, clock, timings):
+        branches = state.get('Branches', [])
+        clocks = [clock.fork() for branch in branches]
+        jobs = []
+        for branch, branch_clock in zip(branches, clocks):
+            if self._free_workers.acquire(blocking=False):
+                future = self._pool.submit(self._run_branch, branch, data, branch_clock)
+                future.add_done_callback(lambda future: self._free_workers.release())
+                jobs.append(future)
+            else:
+                jobs.append(self._run_branch(branch, data, branch_clock))
+
+        outputs, failure = [], None
+        for job in jobs:
+            try:
+                output, branch_timings = job.result() if hasattr(job, 'result') else job
+            except (_Failure, ExecutionRuntimeError) as e:
+                failure = failure or e
+                continue
+            outputs.append(output)
+            timings.extend(branch_timings)
+        # the branches ran side by side, so the slowest one decides the elapsed time
+        clock.elapsed = max([clock.elapsed] + [branch_clock.elapsed for branch_clock in clocks])
+        if failure:
+            raise failure
+        return outputs
+
+
+def timing_summary(executions):
+    summary = {}
+    for execution in executions:
+        for timing in execution.timings:
+            count, seconds, virtual = summary.get(timing.name, (0, 0.0, 0.0))
+            summary[timing.name] = (count + 1, seconds + timing.seconds, virtual + timing.virtual_seconds)
+    return summary
+
+
+def print_timings(executions):
+    summary = timing_summary(executions)
+    print('{:<40} {:>8} {:>12} {:>12} {:>12}'.format('State', 'Runs', 'Total ms', 'Mean ms', 'Virtual s'))
+    for name, (count, seconds, virtual) in sorted(summary.items(), key=lambda item: -item[1][1]):
+        print('{:<40} {:>8} {:>12.2f} {:>12.3f} {:>12.1f}'.format(name, count, seconds * 1000,
+                                                                   seconds * 1000 / count, virtual))
+    succeeded = len([execution for execution in executions if execution.status == SUCCEEDED])
+    print('{} executions, {} succeeded, {} failed'.format(len(executions), succeeded, len(executions) - succeeded))
@@ -1,183 +1,481 @@
-import boto3
 import json
+from glintpy.scripts.clients import ClientPool
+from glintpy.scripts.step_functions import StateMachineError, deploy_state_machine, existing_state_machines
+
+
+def _holds_node(value, depth=2):
+    # nodes sit at most two levels down in _fields(), e.g. {'States': {name: state}}
+    if isinstance(value, JSONifyMixin):
+        return True
+    if depth and isinstance(value, dict):
+        return any(_holds_node(item, depth - 1) for item in value.values())
+    if depth and isinstance(value, list):
+        return any(_holds_node(item, depth - 1) for item in value)
+    return False
+
+
+def _plain(value):
+    if isinstance(value, JSONifyMixin):
+        return value._cached_dict()
+    if not _holds_node(value):
+        return value
+    if isinstance(value, dict):
+        return {key: _plain(item) for key, item in value.items()}
+    return [_plain(item) for item in value]
+
+
+def _encode(value):
+    # same output as json.dumps of the plain value, reusing the cached json of nodes
+    if isinstance(value, JSONifyMixin):
+        return value._cached_json()
+    if not _holds_node(value):
+        return json.dumps(value)
+    if isinstance(value, dict):
+        return '{' + ', '.join(json.dumps(key) + ': ' + _encode(item) for key, item in value.items()) + '}'
+    return '[' + ', '.join(_encode(item) for item in value) + ']'
+
 
 class JSONifyMixin(object):
+    # the dict and json forms are cached until an attribute or a child of the node changes
+    __slots__ = ('_dict', '_json', '_parents')
+
+    def _init_cache(self):
+        self._dict = None
+        self._json = None
+        self._parents = []
+
+    def __setattr__(self, key, value):
+        object.__setattr__(self, key, value)
+        if key[0] != '_':
+            self._invalidate()
+
+    def _invalidate(self):
+        # a parent only caches once its children have, so an uncached node has uncached parents
+        if getattr(self, '_dict', None) is None and getattr(self, '_json', None) is None:
+            return
+        self._dict = None
+        self._json = None
+        for parent in self._parents:
+            parent._invalidate()
+
+    def _adopt(self, child):
+        child._parents.append(self)
+        return child
+
+    def _fields(self):
+        raise NotImplementedError
+
+    def _cached_dict(self):
+        if self._dict is None:
+            self._dict = _plain(self._fields())
+        return self._dict
+
+    def _cached_json(self):
+        if self._json is None:
+            self._json = _encode(self._fields())
+        return self._json
+
     def to_json(self):
-        return json.dumps(self._config)
+        return self._cached_json()
 
     def to_dict(self):
-        return self._config
+        return self._cached_dict()
 
-class StateMachine(JSONifyMixin):
-    def __init__(self, start_at, comment='', timeout_seconds=None,
-                 version=None, states={}):
-        self._config = {'StartAt': start_at,
-                        'States': states}
 
-        if comment:
-            self._config['Comment'] = comment
+class _StateGraph(JSONifyMixin):
+    __slots__ = ('start_at', 'states')
 
-        if timeout_seconds:
-            self._config['TimeoutSeconds'] = timeout_seconds
+    def add_state(self, state):
+        if not isinstance(state, State):
+            raise TypeError('Invalid State object.')
+        previous = self.states.get(state.name)
+        if previous is not None and self in previous._parents:
+            previous._parents.remove(self)
+        self.states[state.name] = self._adopt(state)
+        self._invalidate()
 
-        if version:
-            self._config['Version'] = version
+    def validate(self):
+        errors = []
+        _validate_graph(type(self).__name__, self.start_at, self.states, errors)
+        return errors
 
-    def create_state_machine(self, name, definition, role_arn):
-        client = boto3.client('stepfunctions', region_name='ap-northeast-1')
+
+class StateMachine(_StateGraph):
+    __slots__ = ('comment', 'timeout_seconds', 'version')
+
+    def __init__(self, start_at, comment='', timeout_seconds=None,
+                 version=None, states=None):
+        self._init_cache()
+        self.start_at = start_at
+        self.states = {}
+        self.comment = comment
+        self.timeout_seconds = timeout_seconds
+        self.version = version
+
+        if isinstance(states, dict):
+            # raw Amazon States Language definitions keyed by name
+            for name, body in states.items():
+                self.states[name] = self._adopt(_RawState(name, body))
+        else:
+            for state in states or []:
+                self.add_state(state)
+
+    def _fields(self):
+        fields = {'StartAt': self.start_at,
+                  'States': self.states}
+
+        if self.comment:
+            fields['Comment'] = self.comment
+
+        if self.timeout_seconds:
+            fields['TimeoutSeconds'] = self.timeout_seconds
+
+        if self.version:
+            fields['Version'] = self.version
+        return fields
+
+    def create_state_machine(self, name, definition=None, role_arn=None, client=None,
+                             region_name=None, validate=True):
+        if validate:
+            errors = self.validate()
+            if errors:
+                raise StateMachineError(errors)
+        if client is None:
+            client = ClientPool.shared(region=region_name).client('stepfunctions')
         response = client.create_state_machine(name=name,
-                                               definition=definition,
+                                               definition=definition or self.to_json(),
                                                roleArn=role_arn)
         return response.get('stateMachineArn', '')
 
+    def deploy(self, name, role_arn, client=None, region_name=None):
+        if client is None:
+            client = ClientPool.shared(region=region_name).client('stepfunctions')
+        action, arn = deploy_state_machine(client, name, self, role_arn,
+                                           existing_state_machines(client).get(name))
+        return arn
+
     def add_state(self, state):
-        if isinstance(state, State):
-            if not self._config.get('States'):
-                # StartAt must be same as the first state's name
-                if list(state.to_dict().keys())[0] != self._config.get('StartAt'):
-                    raise KeyError('Invalide StartAt key')
-                else:
-                    self._config['States'].update(state.to_dict())
-            else:
-                self._config['States'].update(state.to_dict())
-        else:
-            raise TypeError('Invalid State object.')
+        if isinstance(state, State) and not self.states and state.name != self.start_at:
+            # StartAt must be same as the first state's name
+            raise KeyError('Invalide StartAt key')
+        super().add_state(state)
+
 
+class State(JSONifyMixin):
+    __slots__ = ('name',)
 
-class State(object):
     def __init__(self, name):
-        self._config = {name: {'Type': self.__class__.__name__}}
+        self._init_cache()
+        self.name = name
+
+    def _fields(self):
+        return {'Type': self.__class__.__name__}
+
+    def to_dict(self):
+        return {self.name: self._cached_dict()}
+
+    def to_json(self):
+        return '{' + json.dumps(self.name) + ': ' + self._cached_json() + '}'
+
+    def transitions(self):
+        return []
+
+    def is_terminal(self):
+        return False
+
+    def branches_to_validate(self):
+        return []
+
+
+class _NextMixin(object):
+    __slots__ = ()
+
+    def _add_next(self, fields):
+        if self.next:
+            fields['Next'] = self.next
+        else:
+            fields['End'] = True
+        return fields
+
+    def transitions(self):
+        return [self.next] if self.next else []
+
+    def is_terminal(self):
+        return not self.next
+
+
+class Task(_NextMixin, State):
+    __slots__ = ('resource', 'next', 'comment', 'timeout_seconds', 'heartbeat_seconds',
+                 'result_path', 'retry', 'catch')
 
-class Task(JSONifyMixin, State):
     def __init__(self, name, state_resource, state_next='',
                  state_comment='', timeout_seconds=None,
-                 heartbeat_seconds=None, result_path=None, retry=[], catch=[]):
+                 heartbeat_seconds=None, result_path=None, retry=None, catch=None):
         super().__init__(name)
+        self.resource = state_resource
+        self.next = state_next
+        self.comment = state_comment
+        self.timeout_seconds = timeout_seconds
+        self.heartbeat_seconds = heartbeat_seconds
+        self.result_path = result_path
+        self.retry = retry or []
+        self.catch = catch or []
 
-        if state_resource:
-            self._config[name]['Resource'] = state_resource
+    def _fields(self):
+        fields = super()._fields()
 
-        if state_comment:
-            self._config[name]['Comment'] = state_comment
+        if self.resource:
+            fields['Resource'] = self.resource
 
-        if state_next:
-            self._config[name]['Next'] = state_next
-        else:
-            self._config[name]['End'] = True
+        if self.comment:
+            fields['Comment'] = self.comment
+
+        self._add_next(fields)
+
+        if self.timeout_seconds:
+            fields['TimeoutSeconds'] = self.timeout_seconds
+
+        if self.heartbeat_seconds:
+            fields['HeartbeatSeconds'] = self.heartbeat_seconds
 
-        if timeout_seconds:
-            self._config['TimeoutSeconds'] = timeout_seconds
+        if self.result_path:
+            fields['ResultPath'] = self.result_path
 
-        if heartbeat_seconds:
-            self._config['HeartbeatSeconds'] = heartbeat_seconds
+        if self.retry:
+            fields['Retry'] = self.retry
 
-        if result_path:
-            self._config['ResultPath'] = result_path
+        if self.catch:
+            fields['Catch'] = self.catch
+        return fields
 
-        if retry:
-            self._config['Retry'] = retry
+    def transitions(self):
+        return super().transitions() + [catcher.get('Next') for catcher in self.catch]
 
-        if catch:
-            self._config['Catch'] = catch
 
+class Parallel(_NextMixin, State):
+    __slots__ = ('branches', 'next')
 
-class Parallel(JSONifyMixin, State):
     def __init__(self, name, branches, state_next=''):
         if not isinstance(branches, list):
             raise TypeError('Invalid argument type, a list is expected.')
 
         super().__init__(name)
-        self._ref = name
-        self._config[name].update({'Branches': [branch.to_dict() for branch in branches]})
+        self.branches = [self._adopt(branch) for branch in branches]
+        self.next = state_next
 
-        if state_next:
-            self._config[name]['Next'] = state_next
-        else:
-            self._config[name]['End'] = True
+    def _fields(self):
+        return self._add_next(dict(super()._fields(), Branches=self.branches))
 
     def add_branch(self, branch):
         if isinstance(branch, Branch):
-            self._config[self._ref]['Branches'].append(branch.to_dict())
+            self.branches.append(self._adopt(branch))
+            self._invalidate()
         else:
             raise TypeError('Invalid Branch object.')
 
-class Branch(JSONifyMixin):
+    def branches_to_validate(self):
+        return self.branches
+
+
+class Branch(_StateGraph):
+    __slots__ = ()
+
     def __init__(self, start_at, init_state):
-        self._config = {'StartAt': start_at,
-                        'States': init_state.to_dict()}
+        self._init_cache()
+        self.start_at = start_at
+        self.states = {}
+        self.add_state(init_state)
 
-    def add_state(self, state):
-        if isinstance(state, State):
-            self._config['States'].update(state.to_dict())
-        else:
-            raise TypeError('Invalid State object.')
+    def _fields(self):
+        return {'StartAt': self.start_at,
+                'States': self.states}
+
+
+class Choice(State):
+    __slots__ = ('choices', 'default')
 
-class Choice(JSONifyMixin, State):
     def __init__(self, name, choices, default=''):
         if not isinstance(choices, list):
             raise TypeError('Invalid argument type, a list is expected.')
 
         super().__init__(name)
-        self._ref = name
+        self.default = default
+        self.choices = [self._adopt(item) for item in choices]
 
-        if default:
-            self._config[name]['Default'] = default
+    def _fields(self):
+        fields = super()._fields()
 
-        self._config[name]['Choices'] = [item.to_dict() for item in choices]
+        if self.default:
+            fields['Default'] = self.default
+
+        fields['Choices'] = self.choices
+        return fields
 
     def add_option(self, choice_option):
-        self._config[self._ref]['Choices'].append(choice_option.to_dict())
+        self.choices.append(self._adopt(choice_option))
+        self._invalidate()
+
+    def transitions(self):
+        return [option.next for option in self.choices] + ([self.default] if self.default else [])
+
 
 class ChoiceOption(JSONifyMixin):
+    __slots__ = ('operation', 'next', 'variable')
+
     def __init__(self, operation=None, state_next=None, variable=None):
         if not isinstance(operation, dict):
             raise TypeError('Invalid argument type, a dict is expected.')
-        
-        self._config = {}
 
-        if operation:
-            self._config.update(operation)
+        self._init_cache()
+        self.operation = operation
+        self.next = state_next
+        self.variable = variable
 
-        if state_next:
-            self._config.update({'Next': state_next})
+    def _fields(self):
+        fields = dict(self.operation)
 
-        if variable:
-            self._config.update({'Variable': variable})
+        if self.next:
+            fields['Next'] = self.next
+
+        if self.variable:
+            fields['Variable'] = self.variable
+        return fields
+
+
+class Wait(_NextMixin, State):
+    __slots__ = ('seconds', 'timestamp', 'next')
 
-class Wait(JSONifyMixin, State):
     def __init__(self, name, time_wait, state_next):
         super().__init__(name)
 
         if isinstance(time_wait, (int, float)):
-            self._config[name]['Seconds'] = time_wait
+            self.seconds, self.timestamp = time_wait, None
         else:
-            self._config[name]['Timestamp'] = time_wait
+            self.seconds, self.timestamp = None, time_wait
+
+        self.next = state_next
 
-        self._config[name]['Next'] = state_next
+    def _fields(self):
+        fields = super()._fields()
+
+        if self.timestamp is None:
+            fields['Seconds'] = self.seconds
+        else:
+            fields['Timestamp'] = self.timestamp
+        return self._add_next(fields)
+
+
+class Pass(_NextMixin, State):
+    __slots__ = ('next', 'result', 'result_path')
 
-class Pass(JSONifyMixin, State):
     def __init__(self, name, state_next=None, result=None, result_path=None):
         super().__init__(name)
+        self.next = state_next
+        self.result = result
+        self.result_path = result_path
 
-        if state_next:
-            self._config[name]['Next'] = state_next
+    def _fields(self):
+        fields = self._add_next(super()._fields())
 
-        if result:
-            self._config[name]['Result'] = result
+        if self.result:
+            fields['Result'] = self.result
 
-        if result_path:
-            self._config[name]['ResultPath'] = result_path
+        if self.result_path:
+            fields['ResultPath'] = self.result_path
+        return fields
 
-class Succeed(JSONifyMixin, State):
-    def __init__(self, name):
-        super().__init__(name)
 
-class Fail(JSONifyMixin, State):
+class Succeed(State):
+    __slots__ = ()
+
+    def is_terminal(self):
+        return True
+
+
+class Fail(State):
+    __slots__ = ('cause', 'error')
+
     def __init__(self, name, cause='', error=''):
         super().__init__(name)
+        self.cause = cause
+        self.error = error
+
+    def _fields(self):
+        fields = super()._fields()
+
+        if self.cause:
+            fields['Cause'] = self.cause
 
-        if cause:
-            self._config['Cause'] = cause
+        if self.error:
+            fields['Error'] = self.error
+        return fields
 
-        if error:
-            self._config['Error'] = error
+    def is_terminal(self):
+        return True
+
+
+class _RawState(State):
+    __slots__ = ('body',)
+
+    def __init__(self, name, body):
+        super().__init__(name)
+        self.body = body
+
+    def _fields(self):
+        return self.body
+
+    def transitions(self):
+        targets = [self.body.get('Next'), self.body.get('Default')]
+        targets += [rule.get('Next') for rule in self.body.get('Choices', [])]
+        targets += [catcher.get('Next') for catcher in self.body.get('Catch', [])]
+        return [target for target in targets if target]
+
+    def is_terminal(self):
+        return self.body.get('Type') in ('Succeed', 'Fail') or bool(self.body.get('End'))
+
+
+def _validate_graph(where, start_at, states, errors):
+    if start_at not in states:
+        errors.append('{}: StartAt {} is not a state'.format(where, start_at))
+
+    edges = {}
+    for name, state in states.items():
+        targets = [target for target in state.transitions() if target]
+        for target in targets:
+            if target not in states:
+                errors.append('{}: {} moves to {} which is not a state'.format(where, name, target))
+        edges[name] = [target for target in targets if target in states]
+        if not targets and not state.is_terminal():
+            errors.append('{}: {} has neither a next state nor an end'.format(where, name))
+        for index, branch in enumerate(state.branches_to_validate()):
+            _validate_graph('{}.{}.Branches[{}]'.format(where, name, index), branch.start_at, branch.states, errors)
+
+    reached = set()
+    pending = [start_at] if start_at in states else []
+    while pending:
+        name = pending.pop()
+        if name not in reached:
+            reached.add(name)
+            pending.extend(edges[name])
+    for name in states:
+        if name not in reached:
+            errors.append('{}: {} can not be reached from {}'.format(where, name, start_at))
+
+    # walk the transitions backwards from the terminal states
+    incoming = {name: [] for name in states}
+    for name, targets in edges.items():
+        for target in targets:
+            incoming[target].append(name)
+    finishing = set()
+    pending = [name for name, state in states.items() if state.is_terminal()]
+    if reached and not any(states[name].is_terminal() for name in reached):
+        errors.append('{}: no terminal state can be reached'.format(where))
+        return
+    while pending:
+        name = pending.pop()
+        if name not in finishing:
+            finishing.add(name)
+            pending.extend(incoming[name])
+    for name in states:
+        if name in reached and name not in finishing:
+            errors.append('{}: {} can never reach a terminal state'.format(where, name))
@@ -0,0 +1,79 @@
+import os
+from concurrent.futures import ThreadPoolExecutor
+from .packaging import hash_file
+
+DEFAULT_THRESHOLD_MB = 40
+DEFAULT_PART_SIZE_MB = 8
+DEFAULT_CONCURRENCY = 4
+# S3 rejects multipart parts smaller than this, except for the last one
+MIN_PART_SIZE = 5 * 1024 * 1024
+
+
+class ArtifactStore(object):
+    def __init__(self, s3_client, bucket, prefix='glint/', threshold_mb=DEFAULT_THRESHOLD_MB,
+                 part_size_mb=DEFAULT_PART_SIZE_MB, concurrency=DEFAULT_CONCURRENCY):
+        self.s3_client = s3_client
+        self.bucket = bucket
+        self.prefix = prefix
+        self.threshold = int(threshold_mb * 1024 * 1024)
+        self.part_size = max(int(part_size_mb * 1024 * 1024), MIN_PART_SIZE)
+        self.concurrency = concurrency
+
+    @classmethod
+    def from_config(cls, data, s3_client):
+        config = data.get('artifactBucket', {})
+        if not config.get('name'):
+            return None
+        return cls(s3_client, config.get('name'),
+                   prefix=config.get('prefix', 'glint/'),
+                   threshold_mb=config.get('thresholdMB', DEFAULT_THRESHOLD_MB),
+                   part_size_mb=config.get('partSizeMB', DEFAULT_PART_SIZE_MB),
+                   concurrency=config.get('concurrency', DEFAULT_CONCURRENCY))
+
+    def wants(self, zip_file):
+        return os.path.getsize(zip_file) > self.threshold
+
+    def exists(self, key):
+        try:
+            self.s3_client.head_object(Bucket=self.bucket, Key=key)
+        except self.s3_client.exceptions.ClientError as e:
+            if e.response.get('Error', {}).get('Code') in ('404', 'NoSuchKey', 'NotFound'):
+                return False
+            raise
+        return True
+
+    def _upload_part(self, zip_file, key, upload_id, number, offset, size):
+        with open(zip_file, 'rb') as f:
+            f.seek(offset)
+            response = self.s3_client.upload_part(Bucket=self.bucket, Key=key, UploadId=upload_id,
+                                                  PartNumber=number, Body=f.read(size))
+        return {'PartNumber': number, 'ETag': response.get('ETag')}
+
+    def _multipart_upload(self, zip_file, key):
+        total = os.path.getsize(zip_file)
+        upload_id = self.s3_client.create_multipart_upload(Bucket=self.bucket, Key=key).get('UploadId')
+        try:
+            with ThreadPoolExecutor(max_workers=self.concurrency) as pool:
+                # only `concurrency` parts are held in memory at any time
+                futures = [pool.submit(self._upload_part, zip_file, key, upload_id, number + 1,
+                                       offset, min(self.part_size, total - offset))
+                           for number, offset in enumerate(range(0, total, self.part_size))]
+                parts = [future.result() for future in futures]
+            self.s3_client.complete_multipart_upload(Bucket=self.bucket, Key=key, UploadId=upload_id,
+                                                     MultipartUpload={'Parts': parts})
+        except Exception:
+            self.s3_client.abort_multipart_upload(Bucket=self.bucket, Key=key, UploadId=upload_id)
+            raise
+
+    def stage(self, zip_file, log=print):
+        key = '{}{}.zip'.format(self.prefix, hash_file(zip_file).hexdigest())
+        if self.exists(key):
+            log('Artifact s3://{}/{} already staged.'.format(self.bucket, key))
+        else:
+            log('Staging artifact to s3://{}/{}...'.format(self.bucket, key))
+            if os.path.getsize(zip_file) <= self.part_size:
+                with open(zip_file, 'rb') as f:
+                    self.s3_client.put_object(Bucket=self.bucket, Key=key, Body=f)
+            else:
+                self._multipart_upload(zip_file, key)
+        return {'S3Bucket': self.bucket, 'S3Key': key}
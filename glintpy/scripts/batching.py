@@ -0,0 +1,60 @@
+import queue
+import threading
+import time
+
+MAX_ERRORS = 10
+
+
+def chunks(values, size):
+    for start in range(0, len(values), size):
+        yield values[start:start + size]
+
+
+class BatchWorkers(object):
+    # subclasses implement process(batch), returning (failed, error), and size(batch)
+    def __init__(self, workers, name='glint-worker'):
+        self.workers = workers
+        self.name = name
+        self._queue = queue.Queue(maxsize=workers * 2)
+        self._lock = threading.Lock()
+        self._threads = []
+        self.failed = 0
+        self.errors = []
+        self.started = None
+
+    def start(self):
+        self.started = time.time()
+        for i in range(self.workers):
+            thread = threading.Thread(target=self._work, name='{}-{}'.format(self.name, i), daemon=True)
+            thread.start()
+            self._threads.append(thread)
+        return self
+
+    def submit(self, batch):
+        # blocks while every worker is busy and the queue is full
+        self._queue.put(batch)
+
+    def close(self):
+        for thread in self._threads:
+            self._queue.put(None)
+        for thread in self._threads:
+            thread.join()
+        self._threads = []
+
+    def elapsed(self):
+        return max(time.time() - (self.started or time.time()), 1e-6)
+
+    def _work(self):
+        while True:
+            batch = self._queue.get()
+            if batch is None:
+                break
+            try:
+                failed, error = self.process(batch)
+            except Exception as e:
+                failed, error = self.size(batch), str(e)
+
+            with self._lock:
+                self.failed += failed
+                if error and len(self.errors) < MAX_ERRORS:
+                    self.errors.append(error)
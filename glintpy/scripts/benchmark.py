@@ -0,0 +1,293 @@
+# offline benchmarks against moto, which is not a glint dependency:
+#   python -m glintpy.scripts.benchmark --sizes 10,100,500 --baseline benchmarks.json
+import click
+import io
+import json
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+from botocore import handlers
+from collections import Counter
+from contextlib import redirect_stdout
+from . import clients
+
+ACCOUNT_ID = '123456789012'
+REGION = 'us-east-1'
+FAST_WAITERS = {kind: {'minDelay': 0.01, 'maxDelay': 0.05} for kind in ['rds', 'nat', 'es', 'lambda', 'dynamodb']}
+MIN_SECONDS_DELTA = 0.05
+
+
+class ApiRecorder(object):
+    def __init__(self, latency=0.0):
+        self.latency = latency
+        self.calls = Counter()
+        self._lock = threading.Lock()
+        self._handler = ('before-call.*.*', self._before_call)
+
+    def _before_call(self, model, **kwargs):
+        with self._lock:
+            self.calls['{}.{}'.format(model.service_model.service_name, model.name)] += 1
+        if self.latency:
+            time.sleep(self.latency)
+
+    def install(self):
+        # sessions built from now on pick the handler up, so drop the cached client pools
+        handlers.BUILTIN_HANDLERS.append(self._handler)
+        clients._pools.clear()
+        return self
+
+    def uninstall(self):
+        handlers.BUILTIN_HANDLERS.remove(self._handler)
+        clients._pools.clear()
+
+    def reset(self):
+        with self._lock:
+            calls, self.calls = self.calls, Counter()
+        return calls
+
+
+def _subnet_cidr(index):
+    return '10.0.{}.{}/26'.format(index // 4, (index % 4) * 64)
+
+
+def synthetic_config(workdir, size, jobs=4, mysql=None):
+    functions = os.path.join(workdir, 'functions')
+    os.makedirs(functions, exist_ok=True)
+    lambdas = []
+    for index in range(size):
+        name = 'bench_fn_{}.py'.format(index)
+        with open(os.path.join(functions, name), 'w') as source:
+            source.write('def handler(event, context):\n    return {}\n'.format(index))
+        lambdas.append({'name': name, 'handler': 'handler', 'runtime': 'python3.9', 'iamRole': 'bench-role',
+                        'timeout': 3, 'path': functions, 'packages': []})
+
+    groups = [{'name': 'bench-sg-{}'.format(index), 'description': 'benchmark',
+               'ingressRules': [{'IpProtocol': 'tcp', 'FromPort': 3306, 'ToPort': 3306,
+                                 'IpRanges': [{'CidrIp': '0.0.0.0/0'}]}]}
+              for index in range(max(1, size // 20))]
+    data = {'region': REGION, 'accessKey': 'testing', 'secretKey': 'testing', 'awsClientID': ACCOUNT_ID,
+            'elasticIP': False, 'parallelism': jobs, 'stackParallelism': jobs,
+            'buildCache': {'enabled': True, 'path': os.path.join(workdir, 'cache')},
+            'wheelhouse': {'enabled': False},
+            'waiters': FAST_WAITERS,
+            'lambdas': lambdas,
+            'vpcs': [{'cidrBlock': '10.0.0.0/16', 'instanceTenancy': 'default',
+                      'subnets': [{'cidr': _subnet_cidr(index), 'availabilityZone': REGION + 'abc'[index % 3]}
+                                  for index in range(size)],
+                      'securityGroups': groups}],
+            'customPolicies': [{'name': 'bench-policy-{}'.format(index),
+                                'document': json.dumps({'Version': '2012-10-17',
+                                                        'Statement': [{'Effect': 'Allow', 'Action': 's3:GetObject',
+                                                                       'Resource': '*'}]})}
+                               for index in range(max(1, size // 10))],
+            'iamRoles': [{'roleName': 'bench-role-{}'.format(index), 'assumedRole': '{}', 'policies': []}
+                         for index in range(max(1, size // 10))],
+            'rds': [],
+            'sns': [{'name': 'bench-topic'}],
+            'cloudWatch': {'alarms': [{'name': 'bench-alarm-{}'.format(index), 'description': '', 'enabled': True,
+                                       'alarmAction': ['bench-topic'], 'dimensions': [],
+                                       'metricName': 'Errors', 'namespace': 'Bench', 'statistic': 'Sum',
+                                       'period': 60, 'unit': 'Count', 'evaluationPeriods': 1, 'threshold': index,
+                                       'comparisonOperator': 'GreaterThanOrEqualToThreshold'}
+                                      for index in range(size)]},
+            'dynamoDBs': [{'name': 'bench-table-{}'.format(index),
+                           'attributeDefinitions': [{'name': 'id', 'type': 'S'}],
+                           'keySchema': [{'name': 'id', 'type': 'HASH'}],
+                           'provisionedThroughput': {'readCapacityUnits': 5, 'writeCapacityUnits': 5}}
+                          for index in range(max(1, size // 50))],
+            'elasticSearch': [{'domainName': 'bench-domain-{}'.format(index),
+                               'version': '5.3' if index % 2 else '7.1',
+                               'createIndices': False, 'accessPolicies': '', 'automatedSnapshotStartHour': 0,
+                               'config': {'instanceType': 't2.small.elasticsearch', 'instanceCount': 1,
+                                          'zoneAwarenessEnabled': False},
+                               'ebsOptions': {'enabled': True, 'volumeType': 'gp2', 'volumeSize': 10}}
+                              for index in range(max(2, size // 100))]}
+
+    if mysql:
+        tables = os.path.join(workdir, 'tables')
+        rows = os.path.join(workdir, 'data')
+        os.makedirs(tables, exist_ok=True)
+        os.makedirs(rows, exist_ok=True)
+        with open(os.path.join(tables, 'bench.sql'), 'w') as ddl:
+            ddl.write('CREATE TABLE bench (id INT PRIMARY KEY, name VARCHAR(64));\n')
+        with open(os.path.join(rows, 'bench.csv'), 'w') as csv_file:
+            csv_file.write('id,name\n' + ''.join('{},row {}\n'.format(row, row) for row in range(size * 100)))
+        data['rds'] = [{'skip': True, 'identifier': 'bench-db', 'endpoint': mysql.get('host'),
+                        'port': mysql.get('port', 3306), 'username': mysql.get('user'),
+                        'password': mysql.get('password'),
+                        'databases': [{'name': 'glint_bench_{}'.format(index), 'tablePath': tables, 'dataPath': rows}
+                                      for index in range(max(1, size // 50))]}]
+
+    path = os.path.join(workdir, 'package.json')
+    with open(path, 'w') as package:
+        json.dump(data, package)
+    return path
+
+
+def _measure(name, fn, recorder, memory=True):
+    output = io.StringIO()
+    if memory:
+        tracemalloc.start()
+    started = time.perf_counter()
+    error = None
+    try:
+        with redirect_stdout(output):
+            fn()
+    except SystemExit as e:
+        error = 'exited with {}'.format(e.code) if e.code else None
+    except Exception as e:
+        error = '{}: {}'.format(type(e).__name__, e)
+    seconds = time.perf_counter() - started
+    peak = 0
+    if memory:
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+    calls = recorder.reset()
+    return {'phase': name, 'seconds': round(seconds, 3), 'calls': sum(calls.values()),
+            'peakMB': round(peak / 1048576.0, 2), 'topCalls': dict(calls.most_common(5)), 'error': error,
+            'log': output.getvalue() if error else ''}
+
+
+def _warm_up():
+    # moto loads each service backend on its first call, keep that out of the first phase
+    import boto3
+    for service, operation in [('ec2', 'describe_vpcs'), ('iam', 'list_roles'), ('rds', 'describe_db_instances'),
+                               ('sns', 'list_topics'), ('cloudwatch', 'describe_alarms'),
+                               ('dynamodb', 'list_tables'), ('lambda', 'list_functions'),
+                               ('es', 'list_domain_names'), ('s3', 'list_buckets')]:
+        getattr(boto3.client(service, region_name=REGION), operation)()
+
+
+def run_size(size, jobs=4, latency=0.0, memory=True, mysql=None):
+    from moto import mock_aws
+    import boto3
+    from .config import load_config
+    from .elasticsearch import es_automate
+    from .lambdas import lambda_automate
+    from .new_stack import setup_databases, stack_automate
+
+    os.environ.setdefault('AWS_ACCESS_KEY_ID', 'testing')
+    os.environ.setdefault('AWS_SECRET_ACCESS_KEY', 'testing')
+    workdir = tempfile.mkdtemp(prefix='glint_bench_')
+    recorder = ApiRecorder(latency)
+    results = []
+    try:
+        data = load_config(synthetic_config(workdir, size, jobs=jobs, mysql=mysql))
+        with mock_aws():
+            boto3.client('iam', region_name=REGION).create_role(
+                RoleName='bench-role', AssumeRolePolicyDocument=json.dumps(
+                    {'Version': '2012-10-17', 'Statement': [{'Effect': 'Allow', 'Action': 'sts:AssumeRole',
+                                                             'Principal': {'Service': 'lambda.amazonaws.com'}}]}))
+            _warm_up()
+            recorder.install()
+            try:
+                phases = [('stack', lambda: stack_automate(data, jobs=jobs)),
+                          ('stack-apply-noop', lambda: stack_automate(data, jobs=jobs, apply=True)),
+                          ('lambda', lambda: lambda_automate(data, jobs=jobs, use_cache=True)),
+                          ('lambda-rerun', lambda: lambda_automate(data, jobs=jobs, use_cache=True)),
+                          ('es', lambda: es_automate(data))]
+                if mysql:
+                    phases.append(('databases', lambda: setup_databases(data.get('rds')[0], mysql.get('host'))))
+                for name, fn in phases:
+                    result = _measure(name, fn, recorder, memory=memory)
+                    result['size'] = size
+                    results.append(result)
+            finally:
+                recorder.uninstall()
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+    return results
+
+
+def baseline_key(result):
+    return '{}/{}'.format(result.get('phase'), result.get('size'))
+
+
+def compare(results, baseline, tolerance):
+    regressions = []
+    for result in results:
+        base = baseline.get(baseline_key(result))
+        if not base:
+            continue
+        if result.get('error'):
+            regressions.append('{} failed: {}'.format(baseline_key(result), result.get('error')))
+            continue
+        if result['seconds'] > base['seconds'] * (1 + tolerance) and \
+           result['seconds'] - base['seconds'] > MIN_SECONDS_DELTA:
+            regressions.append('{} took {}s, baseline {}s'.format(baseline_key(result), result['seconds'],
+                                                                 base['seconds']))
+        if result['calls'] > base['calls']:
+            # call counts are deterministic against moto, so any increase is real
+            regressions.append('{} made {} API calls, baseline {}'.format(baseline_key(result), result['calls'],
+                                                                          base['calls']))
+        if base.get('peakMB') and result['peakMB'] > base['peakMB'] * (1 + tolerance):
+            regressions.append('{} peaked at {}MB, baseline {}MB'.format(baseline_key(result), result['peakMB'],
+                                                                        base['peakMB']))
+    return regressions
+
+
+def print_results(results):
+    print('{:<18} {:>6} {:>10} {:>8} {:>9}  {}'.format('Phase', 'Size', 'Seconds', 'Calls', 'Peak MB',
+                                                        'Busiest operations'))
+    for result in results:
+        busiest = ', '.join('{} x{}'.format(name, count) for name, count in result.get('topCalls', {}).items())
+        print('{:<18} {:>6} {:>10.3f} {:>8} {:>9.2f}  {}'.format(result['phase'], result['size'], result['seconds'],
+                                                                  result['calls'], result['peakMB'],
+                                                                  'FAILED - ' + result['error'] if result.get('error')
+                                                                  else busiest))
+
+
+@click.command()
+@click.option('--sizes', default='10,100', help='comma separated fixture sizes')
+@click.option('--jobs', default=4, type=int, help='parallelism and stackParallelism of the fixtures')
+@click.option('--latency-ms', default=0.0, type=float, help='delay added to every AWS API call')
+@click.option('--no-memory', is_flag=True, help='skip tracemalloc, which slows the phases down')
+@click.option('--baseline', default=None, help='baseline json file to check against or update')
+@click.option('--update-baseline', is_flag=True, help='store these results as the baseline')
+@click.option('--tolerance', default=0.25, type=float, help='allowed relative slowdown before failing')
+@click.option('--mysql', default=None, help='user:password@host[:port] of a local MySQL for the databases phase')
+def main(sizes, jobs, latency_ms, no_memory, baseline, update_baseline, tolerance, mysql):
+    server = None
+    if mysql:
+        credentials, _, address = mysql.rpartition('@')
+        user, _, password = credentials.partition(':')
+        host, _, port = address.partition(':')
+        server = {'user': user, 'password': password, 'host': host, 'port': int(port or 3306)}
+
+    results = []
+    for size in [int(size) for size in sizes.split(',') if size]:
+        results.extend(run_size(size, jobs=jobs, latency=latency_ms / 1000.0, memory=not no_memory, mysql=server))
+    print_results(results)
+    for result in results:
+        if result.get('error') and result.get('log'):
+            print('--- {} log tail:\n{}'.format(baseline_key(result), result['log'][-2000:]))
+
+    if not baseline:
+        return
+    if update_baseline:
+        stored = {}
+        if os.path.exists(baseline):
+            with open(baseline) as baseline_file:
+                stored = json.load(baseline_file)
+        stored.update({baseline_key(result): {key: result[key] for key in ['seconds', 'calls', 'peakMB']}
+                       for result in results if not result.get('error')})
+        with open(baseline, 'w') as baseline_file:
+            json.dump(stored, baseline_file, indent=2, sort_keys=True)
+        print('Baseline written to {}'.format(baseline))
+        return
+
+    with open(baseline) as baseline_file:
+        regressions = compare(results, json.load(baseline_file), tolerance)
+    for regression in regressions:
+        print('Regression. {}'.format(regression))
+    if regressions:
+        sys.exit(1)
+    print('No regressions against {}.'.format(baseline))
+
+
+if __name__ == '__main__':
+    main()
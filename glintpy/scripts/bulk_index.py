@@ -0,0 +1,107 @@
+import json
+import pymysql
+import re
+import requests
+import time
+from .batching import BatchWorkers
+
+DEFAULT_CHUNK_SIZE = 1000
+DEFAULT_WORKERS = 4
+MAX_RETRIES = 5
+
+
+def stream_rows(connection, sql, chunk_size=DEFAULT_CHUNK_SIZE):
+    with connection.cursor(pymysql.cursors.SSDictCursor) as cursor:
+        cursor.execute(sql)
+        while True:
+            rows = cursor.fetchmany(chunk_size)
+            if not rows:
+                break
+            yield rows
+
+
+def bulk_doc_type(version, index, doc_type=None):
+    # elasticsearch before 7 rejects bulk actions without a _type
+    match = re.match(r'(\d+)\.', version or '')
+    if match and int(match.group(1)) < 7:
+        return doc_type or index
+    return None
+
+
+def to_ndjson(rows, index, id_field=None, doc_type=None):
+    lines = []
+    for row in rows:
+        action = {'_index': index}
+        if doc_type:
+            action['_type'] = doc_type
+        if id_field and row.get(id_field) is not None:
+            action['_id'] = str(row.get(id_field))
+        lines.append(json.dumps({'index': action}))
+        lines.append(json.dumps(row, default=str))
+    return ('\n'.join(lines) + '\n').encode('utf-8')
+
+
+class BulkIndexer(BatchWorkers):
+    def __init__(self, url, workers=DEFAULT_WORKERS, session=None):
+        super().__init__(workers, name='glint-bulk')
+        self.url = url.rstrip('/') + '/_bulk'
+        self.session = session or requests.Session()
+        self.documents = 0
+        self.bytes = 0
+
+    def submit(self, body, count):
+        super().submit((body, count))
+
+    def size(self, batch):
+        return batch[1]
+
+    def _post(self, body):
+        delay = 1
+        for attempt in range(MAX_RETRIES):
+            response = self.session.post(self.url, data=body,
+                                         headers={'Content-Type': 'application/x-ndjson'})
+            if response.status_code not in (429, 502, 503, 504):
+                return response
+            time.sleep(delay)
+            delay *= 2
+        return response
+
+    def process(self, batch):
+        body, count = batch
+        response = self._post(body)
+        failed, error = 0, None
+        if response.status_code >= 300:
+            failed = count
+            error = 'HTTP {}: {}'.format(response.status_code, response.text[:200])
+        else:
+            result = response.json()
+            if result.get('errors'):
+                failed = len([item for item in result.get('items', [])
+                              if list(item.values())[0].get('error')])
+            error = 'bulk item errors' if failed else None
+        with self._lock:
+            self.documents += count - failed
+            self.bytes += len(body)
+        return failed, error
+
+    def stats(self):
+        elapsed = self.elapsed()
+        return '{} documents indexed, {} failed, {:.1f} MB in {:.1f}s ({:.0f} docs/s, {:.2f} MB/s)'.format(
+            self.documents, self.failed, self.bytes / 1048576.0, elapsed,
+            self.documents / elapsed, self.bytes / 1048576.0 / elapsed)
+
+
+def bulk_load(connection, sql, url, index, id_field=None, chunk_size=DEFAULT_CHUNK_SIZE,
+              workers=DEFAULT_WORKERS, report_every=100, doc_type=None):
+    indexer = BulkIndexer(url, workers=workers).start()
+    try:
+        for number, rows in enumerate(stream_rows(connection, sql, chunk_size), 1):
+            indexer.submit(to_ndjson(rows, index, id_field, doc_type), len(rows))
+            if number % report_every == 0:
+                print(indexer.stats())
+    finally:
+        indexer.close()
+    print(indexer.stats())
+    for error in indexer.errors:
+        print('Error. {}'.format(error))
+    return indexer
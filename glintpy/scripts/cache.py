@@ -0,0 +1,92 @@
+import json
+import os
+import shutil
+import tempfile
+from .packaging import hash_file
+
+DEFAULT_CACHE_PATH = '~/.glint/cache'
+DEFAULT_MAX_SIZE_MB = 1024
+# bump when the packaging output changes so stale zips are not reused
+CACHE_FORMAT = 2
+
+
+def unpinned(packages):
+    # anything but an exact pin may resolve to a newer release than the cached zip holds
+    return [package for package in packages or [] if '==' not in package or '*' in package]
+
+
+class BuildCache(object):
+    def __init__(self, path=DEFAULT_CACHE_PATH, max_size_mb=DEFAULT_MAX_SIZE_MB):
+        self.path = os.path.abspath(os.path.expanduser(path))
+        self.max_size = int(max_size_mb * 1024 * 1024)
+
+    @classmethod
+    def from_config(cls, data):
+        config = data.get('buildCache', {})
+        if config.get('enabled') is False:
+            return None
+        return cls(path=config.get('path', DEFAULT_CACHE_PATH),
+                   max_size_mb=config.get('maxSizeMB', DEFAULT_MAX_SIZE_MB))
+
+    def key(self, source_file, packages, runtime, settings=None):
+        digest = hash_file(source_file)
+        digest.update(json.dumps({'format': CACHE_FORMAT,
+                                  'packages': sorted(packages or []),
+                                  'runtime': (runtime or '').lower(),
+                                  'settings': settings or {}},
+                                 sort_keys=True).encode('utf-8'))
+        return digest.hexdigest()
+
+    def holds(self, zip_file):
+        return os.path.dirname(os.path.abspath(zip_file)) == self.path
+
+    def _entry(self, key):
+        return os.path.join(self.path, key + '.zip')
+
+    def get(self, key):
+        entry = self._entry(key)
+        if not os.path.exists(entry):
+            return None
+        os.utime(entry, None)
+        return entry
+
+    def put(self, key, zip_file):
+        if not os.path.exists(self.path):
+            os.makedirs(self.path, exist_ok=True)
+        # stage next to the final entry so the rename is atomic across workers
+        fd, staging = tempfile.mkstemp(dir=self.path, suffix='.tmp')
+        os.close(fd)
+        shutil.move(zip_file, staging)
+        entry = self._entry(key)
+        os.replace(staging, entry)
+        return entry
+
+    def entries(self):
+        if not os.path.exists(self.path):
+            return []
+        entries = []
+        for name in os.listdir(self.path):
+            if name.endswith('.zip'):
+                try:
+                    stat = os.stat(os.path.join(self.path, name))
+                except FileNotFoundError:
+                    # evicted by a concurrent build
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, os.path.join(self.path, name)))
+        return sorted(entries)
+
+    def prune(self, max_size=None):
+        max_size = self.max_size if max_size is None else max_size
+        entries = self.entries()
+        total = sum(size for mtime, size, entry in entries)
+        removed = 0
+        for mtime, size, entry in entries:
+            if total <= max_size:
+                break
+            try:
+                os.remove(entry)
+            except FileNotFoundError:
+                pass
+            total -= size
+            removed += 1
+        return removed, total
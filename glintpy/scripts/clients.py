@@ -0,0 +1,69 @@
+import boto3
+import json
+import threading
+from botocore.config import Config
+from .limits import RateLimiter
+from .tracing import instrument
+
+DEFAULT_CLIENT_CONFIG = {'maxPoolConnections': 50,
+                         'retryMode': 'standard',
+                         'maxAttempts': 5,
+                         'connectTimeout': 10,
+                         'readTimeout': 60}
+
+_pools = {}
+_pools_lock = threading.Lock()
+
+
+class ClientPool(object):
+    def __init__(self, region=None, access_key=None, secret_key=None, profile=None, client_config=None,
+                 rate_limits=None):
+        self.region = region or None
+        self.session = boto3.session.Session(aws_access_key_id=access_key or None,
+                                             aws_secret_access_key=secret_key or None,
+                                             profile_name=profile or None,
+                                             region_name=self.region)
+        instrument(self.session.events)
+        self.limiter = RateLimiter(rate_limits)
+        self.limiter.instrument(self.session.events)
+        settings = dict(DEFAULT_CLIENT_CONFIG, **(client_config or {}))
+        self.config = Config(max_pool_connections=settings.get('maxPoolConnections'),
+                             retries={'mode': settings.get('retryMode'),
+                                      'max_attempts': settings.get('maxAttempts')},
+                             connect_timeout=settings.get('connectTimeout'),
+                             read_timeout=settings.get('readTimeout'))
+        self._clients = {}
+        self._lock = threading.Lock()
+
+    @classmethod
+    def shared(cls, region=None, access_key=None, secret_key=None, profile=None, client_config=None,
+               rate_limits=None):
+        key = (region or None, access_key or None, secret_key or None, profile or None,
+               tuple(sorted((client_config or {}).items())), json.dumps(rate_limits or {}, sort_keys=True))
+        with _pools_lock:
+            if key not in _pools:
+                _pools[key] = cls(region=region, access_key=access_key, secret_key=secret_key,
+                                  profile=profile, client_config=client_config, rate_limits=rate_limits)
+            return _pools[key]
+
+    @classmethod
+    def from_config(cls, data):
+        return cls.shared(region=data.get('region'),
+                          access_key=data.get('accessKey'),
+                          secret_key=data.get('secretKey'),
+                          profile=data.get('profile'),
+                          client_config=data.get('clientConfig'),
+                          rate_limits=data.get('rateLimits'))
+
+    def client(self, service, region=None):
+        key = (service, region or self.region)
+        with self._lock:
+            if key not in self._clients:
+                self._clients[key] = self.session.client(service, region_name=key[1], config=self.config)
+            return self._clients[key]
+
+
+def compact(params):
+    # boto3 rejects None, so unset optional settings are left out
+    return {key: compact(value) if isinstance(value, dict) else value
+            for key, value in params.items() if value is not None}
@@ -0,0 +1,199 @@
+import json
+import os
+import sys
+
+NUMBER = (int, float)
+
+# top level settings: [(key, type, required)]
+SETTINGS = [('parallelism', int, False), ('stackParallelism', int, False), ('cloudWatch', dict, False),
+            ('buildCache', dict, False), ('wheelhouse', dict, False), ('layers', dict, False),
+            ('artifactBucket', dict, False), ('slimming', dict, False), ('waiters', dict, False),
+            ('rateLimits', dict, False), ('journal', dict, False), ('clientConfig', dict, False)]
+
+# section: [(key, type, required)], checked on every entry that is not skipped
+SCHEMA = {'lambdas': [('name', str, True), ('path', str, True), ('handler', str, True),
+                      ('runtime', str, True), ('iamRole', str, True), ('timeout', int, False),
+                      ('packages', list, False), ('files', list, False), ('layers', list, False),
+                      ('environmentVariables', dict, False)],
+          'vpcs': [('cidrBlock', str, False), ('subnets', list, True), ('securityGroups', list, True)],
+          'customPolicies': [('name', str, True), ('document', str, True)],
+          'iamRoles': [('roleName', str, True), ('assumedRole', str, True), ('policies', list, True),
+                       ('inlinePolicy', str, False)],
+          'rds': [('identifier', str, True), ('username', str, True), ('password', str, True),
+                  ('engine', str, True), ('instanceClass', str, True), ('allocatedStorage', int, True),
+                  ('subnetGroup', str, True), ('subnetGroupSubnets', list, True),
+                  ('securityGroups', list, True), ('databases', list, True), ('port', int, False),
+                  ('dbParallelism', int, False)],
+          'sns': [('name', str, True)],
+          'dynamoDBs': [('name', str, True), ('attributeDefinitions', list, True), ('keySchema', list, True),
+                        ('provisionedThroughput', dict, True), ('seedFile', str, False),
+                        ('seedSegments', int, False)],
+          'elasticSearch': [('domainName', str, True), ('version', str, True), ('config', dict, True),
+                            ('ebsOptions', dict, True)],
+          'targets': [('region', str, True), ('name', str, False), ('account', str, False),
+                      ('profile', str, False), ('accessKey', str, False), ('secretKey', str, False),
+                      ('overrides', dict, False)]}
+
+ALARM_SCHEMA = [('name', str, True), ('alarmAction', list, True), ('dimensions', list, True),
+                ('metricName', str, True), ('namespace', str, True), ('statistic', str, True),
+                ('period', int, True), ('evaluationPeriods', int, True), ('threshold', NUMBER, True),
+                ('comparisonOperator', str, True)]
+
+SUBNET_SCHEMA = [('cidr', str, True), ('availabilityZone', str, True)]
+SECURITY_GROUP_SCHEMA = [('name', str, True), ('description', str, True), ('ingressRules', list, True)]
+DATABASE_SCHEMA = [('name', str, True), ('tablePath', str, True), ('dataPath', str, False)]
+
+
+class ConfigError(ValueError):
+    def __init__(self, errors):
+        super().__init__('Invalid setting file:\n  ' + '\n  '.join(errors))
+        self.errors = errors
+
+
+class GlintConfig(dict):
+    def __init__(self, data, path=''):
+        super().__init__(data)
+        self.path = path
+        for section in SCHEMA:
+            self.setdefault(section, [])
+        if self.get('cloudWatch') is None:
+            self['cloudWatch'] = {}
+        if isinstance(self.get('cloudWatch'), dict):
+            self['cloudWatch'].setdefault('alarms', [])
+
+    def validate(self):
+        errors = []
+        if not isinstance(self.get('region'), str) or not self.get('region'):
+            errors.append('region must be a non empty string')
+        _check(errors, '', self, SETTINGS)
+        for key in ['parallelism', 'stackParallelism']:
+            if isinstance(self.get(key), int) and self.get(key) < 1:
+                errors.append('{} must be at least 1'.format(key))
+
+        for section, fields in SCHEMA.items():
+            if not isinstance(self.get(section), list):
+                errors.append('{} must be a list'.format(section))
+                continue
+            for index, item in enumerate(self.get(section)):
+                _check(errors, '{}[{}]'.format(section, index), item, fields)
+
+        alarms = []
+        if isinstance(self.get('cloudWatch'), dict):
+            alarms = self.get('cloudWatch').get('alarms')
+            if not isinstance(alarms, list):
+                errors.append('cloudWatch.alarms must be a list')
+                alarms = []
+        for index, item in enumerate(alarms):
+            _check(errors, 'cloudWatch.alarms[{}]'.format(index), item, ALARM_SCHEMA)
+
+        subnets, groups = set(), set()
+        for index, vpc in enumerate(self.get('vpcs')):
+            if not isinstance(vpc, dict):
+                continue
+            if not vpc.get('skip') and not vpc.get('defaultVpc') and not vpc.get('cidrBlock'):
+                errors.append('vpcs[{}].cidrBlock is required unless defaultVpc is set'.format(index))
+            for sub_index, subnet in enumerate(vpc.get('subnets') or []):
+                _check(errors, 'vpcs[{}].subnets[{}]'.format(index, sub_index), subnet, SUBNET_SCHEMA)
+                subnets.add(subnet.get('cidr') if isinstance(subnet, dict) else None)
+            for sub_index, group in enumerate(vpc.get('securityGroups') or []):
+                _check(errors, 'vpcs[{}].securityGroups[{}]'.format(index, sub_index), group,
+                       SECURITY_GROUP_SCHEMA)
+                groups.add(group.get('name') if isinstance(group, dict) else None)
+
+        for index, item in enumerate(self.get('rds')):
+            if not isinstance(item, dict) or item.get('skip'):
+                continue
+            for group in item.get('securityGroups') or []:
+                if group not in groups:
+                    errors.append('rds[{}] uses security group {} which is not defined in vpcs'.format(index, group))
+            for cidr in item.get('subnetGroupSubnets') or []:
+                if cidr not in subnets:
+                    errors.append('rds[{}] uses subnet {} which is not defined in vpcs'.format(index, cidr))
+            for sub_index, db in enumerate(item.get('databases') or []):
+                _check(errors, 'rds[{}].databases[{}]'.format(index, sub_index), db, DATABASE_SCHEMA)
+
+        topics = set(item.get('name') for item in self.get('sns') if isinstance(item, dict))
+        for index, item in enumerate(alarms):
+            if isinstance(item, dict) and not item.get('skip'):
+                if not item.get('alarmAction'):
+                    errors.append('cloudWatch.alarms[{}].alarmAction needs at least one SNS topic'.format(index))
+                for action in item.get('alarmAction') or []:
+                    if action not in topics:
+                        errors.append('cloudWatch.alarms[{}] uses SNS topic {} which is not defined in sns'.format(index, action))
+
+        for index, item in enumerate(self.get('dynamoDBs')):
+            if isinstance(item, dict) and not item.get('skip'):
+                for key in ['readCapacityUnits', 'writeCapacityUnits']:
+                    if not isinstance((item.get('provisionedThroughput') or {}).get(key), int):
+                        errors.append('dynamoDBs[{}].provisionedThroughput.{} must be an integer'.format(index, key))
+                if isinstance(item.get('seedFile'), str) and \
+                   not os.path.exists(os.path.abspath(os.path.expanduser(item.get('seedFile')))):
+                    errors.append('dynamoDBs[{}] cannot find the seed file {}'.format(index, item.get('seedFile')))
+
+        names = set()
+        for index, item in enumerate(self.get('targets')):
+            if isinstance(item, dict) and not item.get('skip'):
+                name = target_name(item)
+                if name in names:
+                    errors.append('targets[{}] has the same name {} as another target'.format(index, name))
+                names.add(name)
+
+        rate_limits = self.get('rateLimits') if isinstance(self.get('rateLimits'), dict) else {}
+        for key, limits in rate_limits.items():
+            if not isinstance(limits, dict):
+                errors.append('rateLimits.{} must be an object'.format(key))
+                continue
+            for name, value in limits.items():
+                if value is not None and (not isinstance(value, NUMBER) or isinstance(value, bool) or value <= 0):
+                    errors.append('rateLimits.{}.{} must be a positive number'.format(key, name))
+
+        for index, item in enumerate(self.get('lambdas')):
+            if isinstance(item, dict) and not item.get('skip') and item.get('path') and item.get('name'):
+                path = os.path.abspath(os.path.expanduser(item.get('path')))
+                if not os.path.exists(os.path.join(path, item.get('name'))):
+                    errors.append('lambdas[{}] cannot find the lambda function {}'.format(index, item.get('name')))
+
+        if errors:
+            raise ConfigError(errors)
+        return self
+
+
+def target_name(target):
+    return target.get('name') or '{}-{}'.format(target.get('account') or target.get('profile') or 'default',
+                                                target.get('region'))
+
+
+def _check(errors, where, item, fields):
+    if not isinstance(item, dict):
+        errors.append('{} must be an object'.format(where))
+        return
+    if item.get('skip'):
+        return
+    for key, kind, required in fields:
+        value = item.get(key)
+        name = '{}.{}'.format(where, key) if where else key
+        if value is None:
+            if required:
+                errors.append('{} is required'.format(name))
+        elif not isinstance(value, kind) or (kind is int and isinstance(value, bool)):
+            names = ' or '.join(k.__name__ for k in kind) if isinstance(kind, tuple) else kind.__name__
+            errors.append('{} must be of type {}'.format(name, names))
+
+
+def load_config(file):
+    if isinstance(file, GlintConfig):
+        return file
+
+    file = os.path.abspath(os.path.expanduser(file))
+    try:
+        with open(file) as data_file:
+            data = GlintConfig(json.load(data_file), path=file)
+    except Exception as e:
+        print('Error. Unable to load the setting file.')
+        sys.exit()
+
+    try:
+        return data.validate()
+    except ConfigError as e:
+        print('Error. {}'.format(e))
+        sys.exit(1)
@@ -0,0 +1,154 @@
+import csv
+import os
+import pymysql
+import queue
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from pymysql.constants import CLIENT
+from .tracing import span
+
+DEFAULT_WORKERS = 4
+DEFAULT_BATCH_SIZE = 500
+# files in dataPath with these extensions go through LOAD DATA LOCAL INFILE
+DELIMITED_FORMATS = {'.csv': ',', '.tsv': '\t'}
+
+
+class ConnectionPool(object):
+    def __init__(self, host, user, password, size=DEFAULT_WORKERS, port=3306):
+        self._settings = {'host': host, 'user': user, 'password': password, 'port': port or 3306,
+                          'charset': 'utf8', 'local_infile': True, 'autocommit': False,
+                          'client_flag': CLIENT.MULTI_STATEMENTS}
+        self._idle = queue.Queue()
+        self._all = []
+        self._lock = threading.Lock()
+        self.size = size
+
+    @contextmanager
+    def connection(self):
+        try:
+            conn = self._idle.get_nowait()
+        except queue.Empty:
+            with self._lock:
+                opened = len(self._all) < self.size
+                if opened:
+                    self._all.append(None)
+            if opened:
+                conn = pymysql.connect(**self._settings)
+                with self._lock:
+                    self._all[self._all.index(None)] = conn
+            else:
+                conn = self._idle.get()
+        try:
+            conn.ping(reconnect=True)
+            yield conn
+        finally:
+            self._idle.put(conn)
+
+    def close(self):
+        for conn in self._all:
+            if conn is not None:
+                conn.close()
+        self._all = []
+
+
+def read_statements(file_path):
+    statement = ''
+    with open(file_path) as sql_file:
+        for line in sql_file:
+            statement += line.partition('#')[0].rstrip()
+            if statement and statement[-1] == ';':
+                yield statement
+                statement = ''
+
+
+def _sql_files(path, ignore):
+    if not path:
+        return []
+    if not os.path.isdir(path):
+        raise FileNotFoundError('Cannot find the sql directory {}'.format(path))
+    return [os.path.join(path, name) for name in sorted(os.listdir(path)) if name not in ignore]
+
+
+def _execute_batched(cursor, statements, batch_size):
+    # several statements per round trip, each result set must be drained
+    batch = []
+    for statement in statements:
+        batch.append(statement)
+        if len(batch) >= batch_size:
+            cursor.execute('\n'.join(batch))
+            while cursor.nextset():
+                pass
+            batch = []
+    if batch:
+        cursor.execute('\n'.join(batch))
+        while cursor.nextset():
+            pass
+
+
+def create_schema(conn, schema):
+    with conn.cursor() as cursor:
+        cursor.execute("SET time_zone = '+00:00';")
+        cursor.execute('DROP DATABASE IF EXISTS `{}`;'.format(schema))
+        cursor.execute('CREATE DATABASE `{}` CHARACTER SET utf8 COLLATE utf8_unicode_ci;'.format(schema))
+        cursor.execute('USE `{}`;'.format(schema))
+
+
+def load_delimited(cursor, schema, file_path):
+    delimiter = DELIMITED_FORMATS[os.path.splitext(file_path)[1].lower()]
+    table = os.path.splitext(os.path.basename(file_path))[0]
+    with open(file_path, newline='') as f:
+        columns = next(csv.reader(f, delimiter=delimiter))
+    cursor.execute("LOAD DATA LOCAL INFILE %s INTO TABLE `{}`.`{}` CHARACTER SET utf8 "
+                   "FIELDS TERMINATED BY %s OPTIONALLY ENCLOSED BY '\"' "
+                   "LINES TERMINATED BY '\\n' IGNORE 1 LINES ({})".format(
+                       schema, table, ', '.join('`{}`'.format(column.strip()) for column in columns)),
+                   (file_path, delimiter))
+
+
+def build_schema(conn, schema, table_path, data_path=None, ignore=(), batch_size=DEFAULT_BATCH_SIZE):
+    create_schema(conn, schema)
+    with conn.cursor() as cursor:
+        for file_path in _sql_files(table_path, ignore):
+            _execute_batched(cursor, read_statements(file_path), batch_size)
+        cursor.execute('SET FOREIGN_KEY_CHECKS = 0;')
+        for file_path in _sql_files(data_path, ignore):
+            if os.path.splitext(file_path)[1].lower() in DELIMITED_FORMATS:
+                load_delimited(cursor, schema, file_path)
+            else:
+                _execute_batched(cursor, read_statements(file_path), batch_size)
+        cursor.execute('SET FOREIGN_KEY_CHECKS = 1;')
+    conn.commit()
+
+
+def _absolute(path):
+    if not path:
+        return path
+    return path if os.path.isabs(path) else os.path.abspath(os.path.expanduser(path))
+
+
+def provision_databases(endpoint, username, password, databases, workers=DEFAULT_WORKERS,
+                        port=3306, ignore=('.DS_Store',), batch_size=DEFAULT_BATCH_SIZE):
+    pool = ConnectionPool(endpoint, username, password, size=workers, port=port)
+
+    def provision(db, schema):
+        with pool.connection() as conn:
+            print('Creating schema {}...'.format(schema))
+            with span('schema ' + schema, 'database'):
+                build_schema(conn, schema, _absolute(db.get('tablePath')), _absolute(db.get('dataPath')),
+                             ignore=ignore, batch_size=batch_size)
+
+    failures = {}
+    try:
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            futures = {executor.submit(provision, db, schema): schema for db in databases
+                       for schema in [db.get('name'), 'unittest_' + db.get('name')]}
+            for future, name in futures.items():
+                try:
+                    future.result()
+                except Exception as e:
+                    print('Error. Unable to set up schema {}: {}'.format(name, e))
+                    failures[name] = e
+    finally:
+        pool.close()
+    return failures
@@ -1,69 +1,86 @@
-import boto3
-import json
-import os
 import pymysql
-import requests
-import sys
+from .bulk_index import DEFAULT_CHUNK_SIZE, DEFAULT_WORKERS, bulk_doc_type, bulk_load
+from .clients import ClientPool, compact
+from .config import load_config
+from .tracing import span, traced
+from .waiters import WaiterHub
 
+@traced('es_automate')
 def es_automate(file):
-    file = os.path.abspath(os.path.expanduser(file))
-    try:
-        with open(file) as data_file:
-            data = json.load(data_file)
-    except Exception as e:
-        print('Error. Unable to load the setting file.')
-        sys.exit()
+    data = load_config(file)
 
     # start to handle Elastic Search here
-    client = boto3.client('es',
-                          region_name=data.get('region', ''),
-                          aws_access_key_id=data.get('accessKey', ''),
-                          aws_secret_access_key=data.get('secretKey', ''))
+    client = ClientPool.from_config(data).client('es')
 
-    for item in data.get('elasticSearch'):
-        if not item.get('skip'):
-            config = {}
-            if item.get('dedicatedMasterEnabled'):
-                config = {'InstanceType': item.get('config').get('instanceType'),
-                          'InstanceCount': item.get('config').get('instanceCount'),
-                          'DedicatedMasterEnabled': True,
-                          'ZoneAwarenessEnabled': item.get('config').get('zoneAwarenessEnabled'),
-                          'DedicatedMasterType': item.get('config').get('dedicatedMasterType'),
-                          'DedicatedMasterCount': item.get('config').get('dedicatedMasterCount')}
-            else:
-                config = {'InstanceType': item.get('config').get('instanceType'),
-                          'InstanceCount': item.get('config').get('instanceCount'),
-                          'DedicatedMasterEnabled': False,
-                          'ZoneAwarenessEnabled': item.get('config').get('zoneAwarenessEnabled')}
+    with WaiterHub({'es': client}, data.get('waiters')) as waiters:
+        domains = []
+        for item in data.get('elasticSearch'):
+            if not item.get('skip'):
+                config = {}
+                if item.get('dedicatedMasterEnabled'):
+                    config = {'InstanceType': item.get('config').get('instanceType'),
+                              'InstanceCount': item.get('config').get('instanceCount'),
+                              'DedicatedMasterEnabled': True,
+                              'ZoneAwarenessEnabled': item.get('config').get('zoneAwarenessEnabled'),
+                              'DedicatedMasterType': item.get('config').get('dedicatedMasterType'),
+                              'DedicatedMasterCount': item.get('config').get('dedicatedMasterCount')}
+                else:
+                    config = {'InstanceType': item.get('config').get('instanceType'),
+                              'InstanceCount': item.get('config').get('instanceCount'),
+                              'DedicatedMasterEnabled': False,
+                              'ZoneAwarenessEnabled': item.get('config').get('zoneAwarenessEnabled')}
 
-            response = client.create_elasticsearch_domain(
-                        DomainName=item.get('domainName'),
-                        ElasticsearchVersion=item.get('version'),
-                        ElasticsearchClusterConfig=config,
-                        EBSOptions={
-                            'EBSEnabled': item.get('ebsOptions').get('enabled'),
-                            'VolumeType': item.get('ebsOptions').get('volumeType'),
-                            'VolumeSize': item.get('ebsOptions').get('volumeSize')
-                        },
-                        AccessPolicies=item.get('accessPolicies'),
-                        SnapshotOptions={
-                            'AutomatedSnapshotStartHour': item.get('automatedSnapshotStartHour')
-                        })
+                response = client.create_elasticsearch_domain(**compact(dict(
+                            DomainName=item.get('domainName'),
+                            ElasticsearchVersion=item.get('version'),
+                            ElasticsearchClusterConfig=config,
+                            EBSOptions={
+                                'EBSEnabled': item.get('ebsOptions').get('enabled'),
+                                'VolumeType': item.get('ebsOptions').get('volumeType'),
+                                'VolumeSize': item.get('ebsOptions').get('volumeSize')
+                            },
+                            AccessPolicies=item.get('accessPolicies'),
+                            SnapshotOptions={
+                                'AutomatedSnapshotStartHour': item.get('automatedSnapshotStartHour')
+                            })))
             
-            print(response)
+                print(response)
+                domains.append((item, waiters.watch('es', item.get('domainName'))))
 
-            #create indices
-            connection = pymysql.connect(host=item.get('dbServer'),
-                                         user=item.get('dbUser'),
-                                         password=item.get('dbPassword'),
-                                         db=item.get('db'),
-                                         charset='utf8mb4',
-                                         cursorclass=pymysql.cursors.DictCursor)
+        for item, domain in domains:
+            print('Waiting for domain {} to be ready...'.format(item.get('domainName')))
+            try:
+                with span('wait es ' + item.get('domainName'), 'wait'):
+                    endpoint = domain.result()
+            except Exception as e:
+                print('Error. {}'.format(e))
+                continue
 
-            with connection.cursor() as cursor:
-                sql = "SELECT * from {}".format(item.get('view'))
-                cursor.execute(sql)
-                cursor.fetchall()
+            if item.get('createIndices', True):
+                #create indices
+                version = client.describe_elasticsearch_domain(DomainName=item.get('domainName')).get(
+                    'DomainStatus', {}).get('ElasticsearchVersion')
+                index = item.get('index', item.get('view'))
+                connection = pymysql.connect(host=item.get('dbServer'),
+                                             user=item.get('dbUser'),
+                                             password=item.get('dbPassword'),
+                                             db=item.get('db'),
+                                             charset='utf8mb4',
+                                             cursorclass=pymysql.cursors.DictCursor)
+
+                print('Indexing {} into {}...'.format(item.get('view'), item.get('domainName')))
+                try:
+                    with span('bulk index ' + item.get('domainName'), 'es'):
+                        bulk_load(connection,
+                                  "SELECT * from {}".format(item.get('view')),
+                                  '{}://{}'.format(item.get('endpointScheme', 'https'), endpoint),
+                                  index,
+                                  id_field=item.get('idField'),
+                                  chunk_size=item.get('bulkSize', DEFAULT_CHUNK_SIZE),
+                                  workers=item.get('bulkWorkers', DEFAULT_WORKERS),
+                                  doc_type=bulk_doc_type(version, index, item.get('docType')))
+                finally:
+                    connection.close()
 
 if __name__ == '__main__':
     es_automate('~/Documents/config/package.json')
\ No newline at end of file
@@ -0,0 +1,203 @@
+import copy
+import multiprocessing
+import os
+import re
+import sys
+import time
+import traceback
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from contextlib import contextmanager
+from .clients import ClientPool
+from .config import ConfigError, GlintConfig, target_name
+from .journal import Journal, config_fingerprint
+from .lambdas import lambda_automate
+from .new_stack import stack_automate
+from .tracing import tracer
+
+OK = 'ok'
+FAILED = 'failed'
+SKIPPED = 'skipped'
+PHASES = ['lambdas', 'stack']
+DEFAULT_LOG_DIR = '~/.glint/logs'
+LOG_TAIL = 20
+
+
+def merge_overrides(base, overrides):
+    merged = copy.deepcopy(base)
+    for key, value in (overrides or {}).items():
+        if isinstance(value, dict) and isinstance(merged.get(key), dict):
+            merged[key] = merge_overrides(merged.get(key), value)
+        else:
+            merged[key] = copy.deepcopy(value)
+    return merged
+
+
+def target_config(data, target):
+    merged = merge_overrides({key: value for key, value in data.items() if key != 'targets'},
+                             target.get('overrides'))
+    merged['region'] = target.get('region')
+    if target.get('account'):
+        # lambda and role ARNs are built from awsClientID
+        merged['awsClientID'] = target.get('account')
+    if target.get('profile'):
+        merged['profile'] = target.get('profile')
+        merged.pop('accessKey', None)
+        merged.pop('secretKey', None)
+    for key in ['accessKey', 'secretKey']:
+        if target.get(key):
+            merged[key] = target.get(key)
+    return GlintConfig(merged, path=data.path)
+
+
+@contextmanager
+def _redirect_output(path):
+    # redirect the file descriptors so pip and other subprocesses land in the target log too
+    sys.stdout.flush()
+    sys.stderr.flush()
+    saved = os.dup(1), os.dup(2)
+    with open(path, 'a') as log_file:
+        os.dup2(log_file.fileno(), 1)
+        os.dup2(log_file.fileno(), 2)
+        try:
+            yield
+        finally:
+            sys.stdout.flush()
+            sys.stderr.flush()
+            os.dup2(saved[0], 1)
+            os.dup2(saved[1], 2)
+            os.close(saved[0])
+            os.close(saved[1])
+
+
+def _check_account(data, account):
+    identity = ClientPool.from_config(data).client('sts').get_caller_identity()
+    if str(identity.get('Account')) != str(account):
+        raise RuntimeError('credentials belong to account {}, not {}'.format(identity.get('Account'), account))
+
+
+def _run_phase(results, phase, deploy):
+    try:
+        deploy()
+        results[phase] = OK
+        return None
+    except SystemExit as e:
+        # code 0 or None means the phase had nothing to do
+        results[phase] = SKIPPED if not e.code else FAILED
+        return None if not e.code else '{} exited with code {}'.format(phase, e.code)
+    except Exception as e:
+        traceback.print_exc()
+        results[phase] = FAILED
+        return '{}: {}: {}'.format(phase, type(e).__name__, e)
+
+
+def _deploy_target(data, target, jobs, use_cache, apply, log_path, trace=False, resume=False):
+    # runs in its own process, nothing is shared between targets
+    started = time.time()
+    tracer.reset(enabled=trace)
+    results = {phase: SKIPPED for phase in PHASES}
+    error = None
+    with _redirect_output(log_path):
+        print('Deploying to {} in {}...'.format(target_name(target), target.get('region')))
+        try:
+            if target.get('account'):
+                _check_account(data, target.get('account'))
+        except Exception as e:
+            error = 'account check: {}'.format(e)
+            print('Error. {}'.format(error))
+            return results, error, time.time() - started, tracer.drain()
+
+        journal = Journal.from_config(data)
+        if resume and not journal.resume(config_fingerprint(data)):
+            return results, None, time.time() - started, tracer.drain()
+        elif not resume:
+            journal.start(config_fingerprint(data))
+
+        if not error and 'lambdas' not in journal.completed and \
+           [item for item in data.get('lambdas') if not item.get('skip')]:
+            error = _run_phase(results, 'lambdas',
+                               lambda: lambda_automate(data, jobs=jobs, use_cache=use_cache))
+            if not error:
+                journal.record('lambdas')
+        if not error:
+            error = _run_phase(results, 'stack',
+                               lambda: stack_automate(data, jobs=jobs, apply=apply, journal=journal))
+        if not error:
+            journal.finish()
+    return results, error, time.time() - started, tracer.drain()
+
+
+def _tail(path, lines=LOG_TAIL):
+    try:
+        with open(path, errors='replace') as log_file:
+            return log_file.read().splitlines()[-lines:]
+    except OSError:
+        return []
+
+
+def fanout_deploy(data, names=None, workers=None, jobs=None, use_cache=True, apply=False, log_dir=None,
+                  resume=False):
+    targets = [target for target in data.get('targets') if not target.get('skip')]
+    if names:
+        targets = [target for target in targets if target_name(target) in names]
+    if not targets:
+        print('Error. No targets found in setting file.')
+        return []
+
+    configs, errors = [], []
+    for target in targets:
+        try:
+            configs.append((target, target_config(data, target).validate()))
+        except ConfigError as e:
+            errors.extend('targets {}: {}'.format(target_name(target), error) for error in e.errors)
+    if errors:
+        print('Error. {}'.format(ConfigError(errors)))
+        return []
+    workers = workers or len(targets)
+    log_dir = os.path.join(os.path.abspath(os.path.expanduser(log_dir or DEFAULT_LOG_DIR)),
+                           time.strftime('%Y%m%d-%H%M%S'))
+    os.makedirs(log_dir, exist_ok=True)
+
+    print('Start to deploy {} targets with {} workers, logs in {}...'.format(len(targets), workers, log_dir))
+    outcomes = []
+    # spawn rather than fork so no worker inherits the parent's clients, locks or threads
+    with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('spawn')) as pool:
+        futures = {}
+        for target, config in configs:
+            log_path = os.path.join(log_dir, re.sub(r'[^\w.-]', '_', target_name(target)) + '.log')
+            futures[pool.submit(_deploy_target, config, target, jobs, use_cache, apply, log_path,
+                                tracer.enabled, resume)] = (target, log_path)
+
+        for future in as_completed(futures):
+            target, log_path = futures[future]
+            try:
+                results, error, seconds, events = future.result()
+                tracer.merge(events)
+            except Exception as e:
+                results, error, seconds = {phase: SKIPPED for phase in PHASES}, '{}: {}'.format(
+                    type(e).__name__, e), 0
+            print('{} {} in {:.1f}s.'.format(target_name(target), 'failed' if error else 'done', seconds))
+            if error:
+                print('----- {} ({}) -----'.format(target_name(target), log_path))
+                for line in _tail(log_path):
+                    print('  ' + line)
+            outcomes.append((target, results, error, seconds))
+
+    order = [target_name(target) for target in targets]
+    outcomes.sort(key=lambda outcome: order.index(target_name(outcome[0])))
+    print_matrix(outcomes)
+    return outcomes
+
+
+def print_matrix(outcomes):
+    print('{:<30} {:<16} {:<14} {:<9} {:<9} {:>8}'.format('Target', 'Region', 'Account', 'Lambdas', 'Stack',
+                                                         'Seconds'))
+    for target, results, error, seconds in outcomes:
+        print('{:<30} {:<16} {:<14} {:<9} {:<9} {:>8.1f}'.format(
+            target_name(target)[:30], target.get('region'), target.get('account') or '-',
+            results.get('lambdas'), results.get('stack'), seconds))
+    for target, results, error, seconds in outcomes:
+        if error:
+            print('Error. {}: {}'.format(target_name(target), error))
+    failed = len([outcome for outcome in outcomes if outcome[2]])
+    print('{} of {} targets deployed, the slowest took {:.1f}s.'.format(
+        len(outcomes) - failed, len(outcomes), max([outcome[3] for outcome in outcomes] or [0])))
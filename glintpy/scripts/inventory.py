@@ -0,0 +1,67 @@
+import threading
+
+# kind: (paginated describe call, response key, id field, {index name: resource field or fields})
+RESOURCE_TYPES = {'vpcs': ('describe_vpcs', 'Vpcs', 'VpcId',
+                           {'cidr': 'CidrBlock'}),
+                  'subnets': ('describe_subnets', 'Subnets', 'SubnetId',
+                              {'cidr': 'CidrBlock', 'vpc': 'VpcId', 'zone': 'AvailabilityZone',
+                               'vpcCidr': ('VpcId', 'CidrBlock')}),
+                  'securityGroups': ('describe_security_groups', 'SecurityGroups', 'GroupId',
+                                     {'name': 'GroupName', 'vpc': 'VpcId'}),
+                  'natGateways': ('describe_nat_gateways', 'NatGateways', 'NatGatewayId',
+                                  {'subnet': 'SubnetId', 'vpc': 'VpcId'})}
+
+
+class Inventory(object):
+    def __init__(self, ec2_cli):
+        self.ec2_cli = ec2_cli
+        # one lock per kind, so describing one kind never holds up lookups of another
+        self._locks = {kind: threading.Lock() for kind in RESOURCE_TYPES}
+        self._resources = {}
+        self._indices = {}
+
+    def _load(self, kind):
+        if kind in self._resources:
+            return
+        operation, key, id_field, fields = RESOURCE_TYPES[kind]
+        self._resources[kind] = {}
+        self._indices[kind] = {name: {} for name in list(fields) + ['tag']}
+        for page in self.ec2_cli.get_paginator(operation).paginate():
+            for resource in page.get(key, []):
+                self._index(kind, resource)
+
+    def _index(self, kind, resource):
+        operation, key, id_field, fields = RESOURCE_TYPES[kind]
+        resource_id = resource.get(id_field)
+        self._resources[kind][resource_id] = resource
+        for name, field in fields.items():
+            value = tuple(resource.get(part) for part in field) if isinstance(field, tuple) else resource.get(field)
+            ids = self._indices[kind][name].setdefault(value, [])
+            if resource_id not in ids:
+                ids.append(resource_id)
+        for tag in resource.get('Tags', []):
+            ids = self._indices[kind]['tag'].setdefault((tag.get('Key'), tag.get('Value')), [])
+            if resource_id not in ids:
+                ids.append(resource_id)
+
+    def add(self, kind, resource):
+        with self._locks[kind]:
+            self._load(kind)
+            self._index(kind, resource)
+        return resource
+
+    def find(self, kind, **criteria):
+        # a tag criterion is given as a (key, value) tuple
+        with self._locks[kind]:
+            self._load(kind)
+            matches = None
+            for name, value in criteria.items():
+                ids = self._indices[kind][name].get(value, [])
+                if matches is None:
+                    matches = list(ids)
+                else:
+                    ids = set(ids)
+                    matches = [resource_id for resource_id in matches if resource_id in ids]
+            if matches is None:
+                matches = list(self._resources[kind])
+            return [self._resources[kind][resource_id] for resource_id in matches]
@@ -0,0 +1,94 @@
+import hashlib
+import json
+import os
+import threading
+import time
+import uuid
+
+DEFAULT_JOURNAL_PATH = '~/.glint/journal'
+
+
+def config_fingerprint(data):
+    return hashlib.sha256(json.dumps(data, sort_keys=True, default=str).encode('utf-8')).hexdigest()
+
+
+class Journal(object):
+    def __init__(self, path):
+        self.path = os.path.abspath(os.path.expanduser(path))
+        self.run = None
+        self.completed = {}
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_config(cls, data):
+        # one journal per package.json, region and credentials
+        settings = data.get('journal') or {}
+        key = '|'.join([getattr(data, 'path', '') or '', data.get('region') or '', data.get('profile') or '',
+                        data.get('accessKey') or ''])
+        name = '{}-{}.jsonl'.format(os.path.splitext(os.path.basename(getattr(data, 'path', '') or 'glint'))[0],
+                                    hashlib.sha1(key.encode('utf-8')).hexdigest()[:12])
+        return cls(os.path.join(os.path.expanduser(settings.get('path') or DEFAULT_JOURNAL_PATH), name))
+
+    def _read(self):
+        records = []
+        if not os.path.exists(self.path):
+            return records
+        with open(self.path) as journal_file:
+            for line in journal_file:
+                try:
+                    records.append(json.loads(line))
+                except ValueError:
+                    continue
+        return records
+
+    def _append(self, record):
+        record['time'] = time.time()
+        line = (json.dumps(record, default=str) + '\n').encode('utf-8')
+        with self._lock:
+            with open(self.path, 'ab+') as journal_file:
+                journal_file.seek(0, os.SEEK_END)
+                if journal_file.tell():
+                    journal_file.seek(-1, os.SEEK_END)
+                    if journal_file.read(1) != b'\n':
+                        # end a line torn by a crash so it cannot swallow this record
+                        line = b'\n' + line
+                journal_file.write(line)
+                journal_file.flush()
+                os.fsync(journal_file.fileno())
+
+    def start(self, fingerprint=None):
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        self.run = uuid.uuid4().hex
+        self.completed = {}
+        self._append({'event': 'start', 'run': self.run, 'fingerprint': fingerprint})
+        return self
+
+    def resume(self, fingerprint=None):
+        records = self._read()
+        runs = [record for record in records if record.get('event') == 'start']
+        if not runs:
+            print('No journaled run found in {}, starting from the top.'.format(self.path))
+            self.start(fingerprint)
+            return True
+
+        last = runs[-1]
+        records = [record for record in records if record.get('run') == last.get('run')]
+        if any(record.get('event') == 'finish' for record in records):
+            print('The last journaled run finished, nothing to resume.')
+            return False
+        if fingerprint and last.get('fingerprint') != fingerprint:
+            print('Warning. package.json changed since the journaled run, its finished steps are still skipped.')
+
+        self.run = last.get('run')
+        self.completed = {record.get('step'): record.get('result') for record in records
+                          if record.get('event') == 'done'}
+        self._append({'event': 'resume', 'run': self.run, 'fingerprint': fingerprint})
+        print('Resuming run {}, {} steps already done.'.format(self.run[:8], len(self.completed)))
+        return True
+
+    def record(self, step, result=None):
+        self.completed[step] = result
+        self._append({'event': 'done', 'run': self.run, 'step': step, 'result': result})
+
+    def finish(self):
+        self._append({'event': 'finish', 'run': self.run})
@@ -1,102 +1,365 @@
-import base64
-import boto3
-import json
+import multiprocessing
 import os
 import sys
 import shutil
-import string
-import random
+import tempfile
+from .artifacts import ArtifactStore
+from .cache import BuildCache, unpinned
+from .clients import ClientPool
+from .config import load_config
+from .layers import extract_layers
+from .packaging import build_zip, code_sha256, walk_tree
+from .slimming import size_report, slim, slimming_config
+from .state import CREATE, UNCHANGED, UPDATE, Change, print_plan, print_summary
+from .tracing import span, traced, tracer
+from .waiters import WaiterHub
+from .wheelhouse import Wheelhouse, run_pip
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
 
-def lambda_automate(file):
-    # Load the list of lambda functions to be updated to AWS
-    file = os.path.abspath(os.path.expanduser(file))
+
+def package_lambda(item, virtualenv, log=print, cache=None, wheelhouse=None, slimming=None):
+    lambda_name = item.get('name', '').split('.')[0]
+    path = item.get('path', '').rstrip('/')
+
+    if not os.path.isabs(path):
+        # in case relative path is given and not in format ~/file_path
+        path = os.path.abspath(os.path.expanduser(path))
+
+    path += '/'
+
+    lambda_file_path = ''.join([path, item.get('name', '')])
+
+    if not os.path.exists(lambda_file_path):
+        raise FileNotFoundError('Cannot find the lambda function {}'.format(item.get('name', '')))
+
+    if cache and unpinned(item.get('packages')):
+        log('Not caching lambda function {}, {} not pinned with ==.'.format(
+            item.get('name', ''), ', '.join(unpinned(item.get('packages')))))
+        cache = None
+
+    cache_key = None
+    if cache:
+        cache_key = cache.key(lambda_file_path, item.get('packages'), item.get('runtime'),
+                              settings={'name': item.get('name', ''),
+                                        'virtualenv': virtualenv,
+                                        'slimming': slimming})
+        cached_zip = cache.get(cache_key)
+        if cached_zip:
+            log('Reusing cached package for lambda function {}.'.format(item.get('name', '')))
+            return cached_zip
+
+    # never build inside the source directory, it may be listed in files
+    fd, zip_path = tempfile.mkstemp(prefix=lambda_name + '_', suffix='.zip')
+    os.close(fd)
+
+    entries = [(item.get('name', ''), lambda_file_path)]
+    workdir = tempfile.mkdtemp(prefix=lambda_name + '_')
     try:
-        with open(file) as data_file:
-            data = json.load(data_file)
-    except Exception as e:
-        print('Error. Unable to load the setting file.')
-        sys.exit()
+        if item.get('packages') and wheelhouse:
+            with span('wheelhouse ' + item.get('name', ''), 'pip'):
+                entries.extend(walk_tree(wheelhouse.install_tree(item.get('packages'), item.get('runtime'),
+                                                                 virtualenv, log=log)))
+        elif item.get('packages'):
+            site_dir = os.path.join(workdir, 'site')
+            with span('pip install ' + item.get('name', ''), 'pip'):
+                failed = run_pip(virtualenv, ['install', '--no-compile'] + item.get('packages') + ['-t', site_dir],
+                                 log=log)
+            if failed:
+                raise RuntimeError('pip install failed for lambda function {}'.format(item.get('name', '')))
+            entries.extend(walk_tree(site_dir))
 
+        log('Packaging Lambda function {}...'.format(item.get('name', '')))
+        if slimming:
+            with span('slim ' + item.get('name', ''), 'zip'):
+                slimmed = slim(entries, slimming, virtualenv, workdir, keep=[item.get('name', '')],
+                               runtime=item.get('runtime'), log=log)
+            with span('zip ' + item.get('name', ''), 'zip'):
+                zip_file = build_zip(zip_path, slimmed,
+                                     compresslevel=slimming.get('compressionLevel'))
+            log(size_report(item.get('name', ''), entries, slimmed, zip_file))
+        else:
+            with span('zip ' + item.get('name', ''), 'zip'):
+                zip_file = build_zip(zip_path, entries)
+    except Exception:
+        _discard(zip_path)
+        raise
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
 
-    lambdas = data.get('lambdas', None)
-    virtualenv = data.get('pythonVirtualenv')
-    lambda_client = boto3.client('lambda',
-                                 region_name=data.get('region'),
-                                 aws_access_key_id=data.get('accessKey', ''),
-                                 aws_secret_access_key=data.get('secretKey', ''))
+    if cache:
+        zip_file = cache.put(cache_key, zip_file)
+
+    log('Done packaging lambda function {}.'.format(item.get('name', '')))
+    return zip_file
+
+
+def _discard(zip_file):
+    try:
+        os.remove(zip_file)
+    except OSError:
+        pass
+
+
+def _function_config(item, app_id):
+    lambda_name = item.get('name', '').split('.')[0]
+    return {'Runtime': item.get('runtime', '').lower(),
+            'Role': "arn:aws:iam::"+app_id+":role/"+item.get('iamRole', ''),
+            'Handler': '.'.join([lambda_name, item.get('handler', '')]),
+            'Environment': {'Variables': item.get('environmentVariables') or {}},
+            'Timeout': item.get('timeout', 3),
+            'Layers': item.get('layers', [])}
+
+
+def _config_changed(deployed, config):
+    for key, value in config.items():
+        if key == 'Environment':
+            if (deployed.get('Environment') or {}).get('Variables', {}) != value.get('Variables'):
+                return True
+        elif key == 'Layers':
+            if [layer.get('Arn') for layer in deployed.get('Layers', [])] != value:
+                return True
+        elif deployed.get(key) != value:
+            return True
+    return False
+
+
+def _code_location(zip_file, artifacts, log=print):
+    # large packages go through S3, everything else is sent inline
+    if artifacts and artifacts.wants(zip_file):
+        with span('upload ' + os.path.basename(zip_file), 'upload'):
+            return artifacts.stage(zip_file, log=log)
+    with open(zip_file, 'rb') as f:
+        return {'ZipFile': f.read()}
+
+
+def _wait_until_ready(lambda_client, lambda_name, waiters):
+    if waiters:
+        waiters.wait('lambda', lambda_name)
+    else:
+        lambda_client.get_waiter('function_updated').wait(FunctionName=lambda_name)
 
-    app_id = data.get('awsClientID')
 
-    if not lambdas:
-        print('ErrorNo lambbda functions found in setting file.')
-        sys.exit()
+def deploy_lambda(lambda_client, item, zip_file, app_id, log=print, artifacts=None, waiters=None):
+    lambda_name = item.get('name', '').split('.')[0]
+    config = _function_config(item, app_id)
+    log('Deploying {}...'.format(lambda_name))
 
-    print('Start to package lambda functions...')
+    try:
+        deployed = lambda_client.get_function(FunctionName=lambda_name).get('Configuration')
+    except lambda_client.exceptions.ResourceNotFoundException:
+        deployed = None
+
+    if not deployed:
+        #Let the script fail if anything goes wrong here
+        response = lambda_client.create_function(FunctionName=lambda_name,
+                                                 Code=_code_location(zip_file, artifacts, log=log),
+                                                 Publish=True,
+                                                 **config)
+        if waiters:
+            waiters.wait('lambda', lambda_name)
+        log('Done deploying '+ item.get('name', ''))
+        return response
+
+    response = deployed
+    code_changed = deployed.get('CodeSha256') != code_sha256(zip_file)
+
+    if _config_changed(deployed, config):
+        log('Updating configuration of {}...'.format(lambda_name))
+        response = lambda_client.update_function_configuration(FunctionName=lambda_name, **config)
+        _wait_until_ready(lambda_client, lambda_name, waiters)
+    elif not code_changed:
+        log('{} is unchanged, skipping.'.format(lambda_name))
+        return response
 
-    for item in lambdas:
-        if not item.get('skip'):
-            lambda_name = item.get('name', '').split('.')[0]
-            path = item.get('path', '').rstrip('/')
+    if code_changed:
+        log('Updating code of {}...'.format(lambda_name))
+        response = lambda_client.update_function_code(FunctionName=lambda_name,
+                                                      Publish=True,
+                                                      **_code_location(zip_file, artifacts, log=log))
+        if waiters:
+            waiters.wait('lambda', lambda_name)
 
-            if not os.path.isabs(path):
-                # in case relative path is given and not in format ~/file_path
-                path = os.path.abspath(os.path.expanduser(path))
+    log('Done deploying '+ item.get('name', ''))
+    return response
+
+
+def _code_changed(deployed, item, virtualenv, cache=None, wheelhouse=None, data=None):
+    logs = []
+    zip_file = package_lambda(item, virtualenv, log=logs.append, cache=cache, wheelhouse=wheelhouse,
+                              slimming=slimming_config(data or {}, item))
+    try:
+        return deployed.get('CodeSha256') != code_sha256(zip_file)
+    finally:
+        if not (cache and cache.holds(zip_file)):
+            _discard(zip_file)
 
-            path += '/' 
 
-            lambda_file_path = ''.join([path, item.get('name', '')])
+def plan_lambdas(lambda_client, items, app_id, virtualenv=None, cache=None, wheelhouse=None, data=None):
+    deployed = {}
+    for page in lambda_client.get_paginator('list_functions').paginate():
+        for function in page.get('Functions', []):
+            deployed[function.get('FunctionName')] = function
 
-            
-            if not os.path.exists(lambda_file_path):
-                raise FileNotFoundError('Cannot find the lambda function {}'.format(item.get('name', '')))
-                sys.exit()
+    changes = []
+    for item in items:
+        lambda_name = item.get('name', '').split('.')[0]
+        if lambda_name not in deployed:
+            changes.append(Change(CREATE, 'lambda', lambda_name, ''))
+            continue
+        changed = []
+        if _code_changed(deployed[lambda_name], item, virtualenv, cache=cache, wheelhouse=wheelhouse, data=data):
+            changed.append('code')
+        if _config_changed(deployed[lambda_name], _function_config(item, app_id)):
+            changed.append('configuration')
+        if changed:
+            changes.append(Change(UPDATE, 'lambda', lambda_name, ' and '.join(changed)))
+        else:
+            changes.append(Change(UNCHANGED, 'lambda', lambda_name, ''))
+    return changes
 
-            tmp_folder = ''.join([path, 
-                                lambda_name,
-                                '_'] + random.choices(string.ascii_lowercase + string.digits, k=16))
 
-            if not os.path.exists(tmp_folder):
-                os.makedirs(tmp_folder)
+def _package_job(item, virtualenv, cache, wheelhouse, slimming, trace=False):
+    # runs in a worker process, logs and trace events go back with the result
+    logs = []
+    tracer.reset(enabled=trace)
+    try:
+        with span('package ' + item.get('name', ''), 'lambda'):
+            zip_file = package_lambda(item, virtualenv, log=logs.append, cache=cache,
+                                      wheelhouse=wheelhouse, slimming=slimming)
+        return zip_file, logs, None, tracer.drain()
+    except Exception as e:
+        return None, logs, '{}: {}'.format(type(e).__name__, e), tracer.drain()
+
+
+def _deploy_job(lambda_client, item, zip_file, app_id, artifacts, waiters):
+    logs = []
+    try:
+        with span('deploy ' + item.get('name', ''), 'lambda'):
+            deploy_lambda(lambda_client, item, zip_file, app_id, log=logs.append, artifacts=artifacts,
+                          waiters=waiters)
+        return logs, None
+    except Exception as e:
+        return logs, '{}: {}'.format(type(e).__name__, e)
 
-            shutil.copy(lambda_file_path, tmp_folder)
 
-            os.system("source {}/bin/activate & pip install {} -t {}".format(
-                virtualenv.rstrip('/'),
-                ' '.join(item.get('packages')),
-                tmp_folder
-            ))
+def _print_logs(name, stage, logs):
+    print('----- {} ({}) -----'.format(name, stage))
+    for line in logs:
+        print(line.rstrip('\n'))
 
-            print('Packaging Lambda function {}...'.format(item.get('name', '')))
 
-            zip_file = shutil.make_archive(base_name=tmp_folder,
-                                        format='zip',
-                                        root_dir=tmp_folder, 
-                                        base_dir='./' )
-            shutil.rmtree(tmp_folder)
+def parallel_deploy(lambda_client, items, virtualenv, app_id, jobs, cache=None, wheelhouse=None,
+                    data=None, artifacts=None, waiters=None):
+    results = []
+    # spawn rather than fork, the waiter hub thread and the boto3 clients are already running
+    with ProcessPoolExecutor(max_workers=jobs, mp_context=multiprocessing.get_context('spawn')) as builders, \
+         ThreadPoolExecutor(max_workers=jobs) as uploaders:
+        builds = {builders.submit(_package_job, item, virtualenv, cache, wheelhouse,
+                                  slimming_config(data or {}, item), tracer.enabled): item
+                  for item in items}
+        uploads = {}
+        for future in as_completed(builds):
+            item = builds[future]
+            try:
+                zip_file, logs, error, events = future.result()
+                tracer.merge(events)
+            except Exception as e:
+                zip_file, logs, error = None, [], '{}: {}'.format(type(e).__name__, e)
+            _print_logs(item.get('name', ''), 'package', logs)
+            if error:
+                results.append((item.get('name', ''), error))
+                continue
+            uploads[uploaders.submit(_deploy_job, lambda_client, item, zip_file, app_id, artifacts,
+                                     waiters)] = (item, zip_file)
 
-            print('Done packaging lambda functions.')
+        for future in as_completed(uploads):
+            item, zip_file = uploads[future]
+            logs, error = future.result()
+            if not (cache and cache.holds(zip_file)):
+                _discard(zip_file)
+            _print_logs(item.get('name', ''), 'deploy', logs)
+            results.append((item.get('name', ''), error))
 
-            print('Start to deploy lambda functions.')
-            with open(zip_file, 'rb') as f:
-                print('Deploying {}...'.format(lambda_name))
+    return results
+
+
+def sequential_deploy(lambda_client, items, virtualenv, app_id, cache=None, wheelhouse=None,
+                      data=None, artifacts=None, waiters=None):
+    results = []
+    for item in items:
+        try:
+            with span('package ' + item.get('name', ''), 'lambda'):
+                zip_file = package_lambda(item, virtualenv, cache=cache, wheelhouse=wheelhouse,
+                                          slimming=slimming_config(data or {}, item))
+        except Exception as e:
+            results.append((item.get('name', ''), '{}: {}'.format(type(e).__name__, e)))
+            continue
+
+        print('Start to deploy lambda functions.')
+        try:
+            with span('deploy ' + item.get('name', ''), 'lambda'):
+                deploy_lambda(lambda_client, item, zip_file, app_id, artifacts=artifacts, waiters=waiters)
+            results.append((item.get('name', ''), None))
+        except Exception as e:
+            results.append((item.get('name', ''), '{}: {}'.format(type(e).__name__, e)))
+        finally:
+            if not (cache and cache.holds(zip_file)):
+                _discard(zip_file)
+
+    return results
+
+
+@traced('lambda_automate')
+def lambda_automate(file, jobs=None, use_cache=True, plan_only=False):
+    # Load the list of lambda functions to be updated to AWS
+    data = load_config(file)
+
+    items = [item for item in data.get('lambdas') if not item.get('skip')]
+    if not items:
+        print('No lambda functions to deploy in setting file.')
+        return
+
+    virtualenv = data.get('pythonVirtualenv')
+    clients = ClientPool.from_config(data)
+    lambda_client = clients.client('lambda')
+
+    app_id = data.get('awsClientID')
+    artifacts = ArtifactStore.from_config(data, clients.client('s3'))
 
-                try:
-                    lambda_client.delete_function(FunctionName=lambda_name)
-                except:
-                    pass
+    jobs = jobs or data.get('parallelism', 1)
+    cache = BuildCache.from_config(data) if use_cache else None
+    wheelhouse = Wheelhouse.from_config(data)
 
-                #Let the script fail if anything goes wrong here
-                response = lambda_client.create_function(FunctionName=lambda_name,
-                                                        Runtime=item.get('runtime', '').lower(),
-                                                        Role="arn:aws:iam::"+app_id+":role/"+item.get('iamRole', ''),
-                                                        Handler='.'.join([lambda_name,
-                                                                          item.get('handler', '')]),
-                                                        Code={'ZipFile': f.read()},
-                                                        Environment={'Variables': item.get('environmentVariables')},
-                                                        Timeout=item.get('timeout', 3),
-                                                        Publish=True)
+    layer_changes = [] if plan_only else None
+    if data.get('layers', {}).get('enabled'):
+        if not plan_only:
+            print('Extracting shared dependencies into lambda layers...')
+        with span('layers', 'lambda'):
+            items = extract_layers(lambda_client, items, virtualenv, data.get('layers'), wheelhouse=wheelhouse,
+                                   slimming=slimming_config(data, {}), artifacts=artifacts,
+                                   log=[].append if plan_only else print, changes=layer_changes)
 
+    if plan_only:
+        print_plan(layer_changes + plan_lambdas(lambda_client, items, app_id, virtualenv, cache=cache,
+                                                wheelhouse=wheelhouse, data=data))
+        return
 
-            print('Done deploying '+ item.get('name', ''))
+    with WaiterHub({'lambda': lambda_client}, data.get('waiters')) as waiters:
+        if jobs > 1:
+            print('Start to package and deploy lambda functions with {} workers...'.format(jobs))
+            results = parallel_deploy(lambda_client, items, virtualenv, app_id, jobs,
+                                      cache=cache, wheelhouse=wheelhouse, data=data, artifacts=artifacts,
+                                      waiters=waiters)
+        else:
+            print('Start to package lambda functions...')
+            results = sequential_deploy(lambda_client, items, virtualenv, app_id,
+                                        cache=cache, wheelhouse=wheelhouse, data=data, artifacts=artifacts,
+                                        waiters=waiters)
 
+    if cache:
+        # pruned only once every zip of this run is deployed, an upload may still be waiting on any of them
+        cache.prune()
+    print_summary('Deployment', [(name, 'succeeded', error) for name, error in results], ['succeeded'])
+    if any(error for name, error in results):
+        sys.exit(1)
     print('Success! Done deploying.')
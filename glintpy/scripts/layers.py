@@ -0,0 +1,114 @@
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+from .packaging import build_zip, code_sha256, walk_tree
+from .slimming import slim
+from .state import CREATE, UNCHANGED, Change
+from .wheelhouse import run_pip
+
+DEFAULT_LAYER_PREFIX = 'glint-deps'
+# lambda only puts the python/ folder of a layer on sys.path
+LAYER_ROOT = 'python/'
+
+
+def shared_dependency_sets(items, min_shared=2):
+    groups = {}
+    for item in items:
+        if item.get('packages'):
+            key = ((item.get('runtime') or '').lower(), tuple(sorted(item.get('packages'))))
+            groups.setdefault(key, []).append(item)
+    return {key: group for key, group in groups.items() if len(group) >= min_shared}
+
+
+def layer_name(prefix, runtime, packages):
+    digest = hashlib.sha256(json.dumps([runtime, sorted(packages)]).encode('utf-8')).hexdigest()
+    return '{}-{}'.format(prefix, digest[:16])
+
+
+def build_layer(packages, runtime, virtualenv, zip_file, wheelhouse=None, slimming=None, log=print):
+    site_dir = None
+    workdir = os.path.dirname(zip_file)
+    try:
+        if wheelhouse:
+            tree = wheelhouse.install_tree(list(packages), runtime, virtualenv, log=log)
+        else:
+            site_dir = tree = tempfile.mkdtemp(prefix='layer_')
+            if run_pip(virtualenv, ['install', '--no-compile'] + list(packages) + ['-t', site_dir], log=log):
+                raise RuntimeError('pip install failed for layer {}'.format(' '.join(packages)))
+        entries = list(walk_tree(tree))
+        if slimming:
+            entries = slim(entries, slimming, virtualenv, workdir, runtime=runtime, log=log)
+        return build_zip(zip_file, [(LAYER_ROOT + arcname, path) for arcname, path in entries],
+                         compresslevel=(slimming or {}).get('compressionLevel'))
+    finally:
+        if site_dir:
+            shutil.rmtree(site_dir, ignore_errors=True)
+
+
+def find_layer_version(lambda_client, name, sha256):
+    latest = True
+    paginator = lambda_client.get_paginator('list_layer_versions')
+    for page in paginator.paginate(LayerName=name):
+        for version in page.get('LayerVersions', []):
+            if version.get('Description') == 'glint sha256:{}'.format(sha256):
+                return version.get('LayerVersionArn')
+            if latest:
+                # versions come newest first, the latest is also checked by its actual content hash
+                latest = False
+                content = lambda_client.get_layer_version_by_arn(Arn=version.get('LayerVersionArn')).get('Content')
+                if (content or {}).get('CodeSha256') == sha256:
+                    return version.get('LayerVersionArn')
+    return None
+
+
+def publish_layer(lambda_client, name, zip_file, runtime, artifacts=None, log=print):
+    sha256 = code_sha256(zip_file)
+    arn = find_layer_version(lambda_client, name, sha256)
+    if arn:
+        log('Layer {} is unchanged, reusing {}.'.format(name, arn))
+        return arn
+
+    log('Publishing layer {}...'.format(name))
+    if artifacts and artifacts.wants(zip_file):
+        content = artifacts.stage(zip_file, log=log)
+    else:
+        with open(zip_file, 'rb') as f:
+            content = {'ZipFile': f.read()}
+    response = lambda_client.publish_layer_version(LayerName=name,
+                                                   Description='glint sha256:{}'.format(sha256),
+                                                   Content=content,
+                                                   CompatibleRuntimes=[runtime])
+    return response.get('LayerVersionArn')
+
+
+def extract_layers(lambda_client, items, virtualenv, config, wheelhouse=None, slimming=None,
+                   artifacts=None, log=print, changes=None):
+    prefix = config.get('prefix', DEFAULT_LAYER_PREFIX)
+    layer_arns = {}
+    for (runtime, packages), group in shared_dependency_sets(items, config.get('minShared', 2)).items():
+        name = layer_name(prefix, runtime, packages)
+        log('Dependencies {} are shared by {} functions.'.format(' '.join(packages), len(group)))
+        workdir = tempfile.mkdtemp(prefix='layer_')
+        try:
+            zip_file = build_layer(packages, runtime, virtualenv, os.path.join(workdir, name + '.zip'),
+                                   wheelhouse=wheelhouse, slimming=slimming, log=log)
+            if changes is None:
+                arn = publish_layer(lambda_client, name, zip_file, runtime, artifacts=artifacts, log=log)
+            else:
+                # plan only, nothing is published and a new version stands in for its future ARN
+                arn = find_layer_version(lambda_client, name, code_sha256(zip_file))
+                changes.append(Change(UNCHANGED if arn else CREATE, 'layer', name, '' if arn else 'new version'))
+                arn = arn or '{}:new'.format(name)
+        finally:
+            shutil.rmtree(workdir, ignore_errors=True)
+        for item in group:
+            layer_arns[id(item)] = arn
+
+    rewritten = []
+    for item in items:
+        if id(item) in layer_arns:
+            item = dict(item, packages=[], layers=list(item.get('layers', [])) + [layer_arns[id(item)]])
+        rewritten.append(item)
+    return rewritten
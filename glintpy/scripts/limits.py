@@ -0,0 +1,133 @@
+import threading
+import time
+from botocore.exceptions import ClientError
+from .tracing import THROTTLE_CODES
+
+# rate and burst are calls per second, None leaves the operation unthrottled
+DEFAULT_LIMITS = {'rate': None, 'burst': None, 'maxConcurrency': 50, 'minConcurrency': 1,
+                  'increase': 1.0, 'decrease': 0.5, 'cooldown': 1.0}
+
+
+def is_throttle(exception):
+    return isinstance(exception, ClientError) and \
+        exception.response.get('Error', {}).get('Code') in THROTTLE_CODES
+
+
+class TokenBucket(object):
+    def __init__(self, rate, burst=None):
+        self.rate = float(rate or 0)
+        self.burst = float(burst or rate or 0)
+        self.tokens = self.burst
+        self._updated = time.time()
+        self._lock = threading.Lock()
+
+    def acquire(self, units=1):
+        if not self.rate:
+            return
+        while True:
+            with self._lock:
+                now = time.time()
+                self.tokens = min(self.burst, self.tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                # a request bigger than the burst goes through on a full bucket
+                if self.tokens >= min(units, self.burst):
+                    self.tokens -= units
+                    return
+                wait = (min(units, self.burst) - self.tokens) / self.rate
+            time.sleep(wait)
+
+
+class AimdLimiter(object):
+    def __init__(self, maximum, minimum=1, increase=1.0, decrease=0.5, cooldown=1.0):
+        self.maximum = float(maximum)
+        self.minimum = float(minimum)
+        self.increase = increase
+        self.decrease = decrease
+        self.cooldown = cooldown
+        self.limit = self.maximum
+        self.in_flight = 0
+        self._last_cut = 0
+        self._condition = threading.Condition()
+
+    def acquire(self):
+        with self._condition:
+            while self.in_flight >= max(int(self.limit), 1):
+                self._condition.wait()
+            self.in_flight += 1
+
+    def release(self, throttled=False):
+        with self._condition:
+            self.in_flight -= 1
+            if throttled:
+                self._cut()
+            else:
+                self.limit = min(self.maximum, self.limit + self.increase / max(self.limit, 1))
+            self._condition.notify_all()
+
+    def throttled(self):
+        with self._condition:
+            return self._cut()
+
+    def _cut(self):
+        now = time.time()
+        if now - self._last_cut < self.cooldown:
+            return False
+        self._last_cut = now
+        self.limit = max(self.minimum, self.limit * self.decrease)
+        return True
+
+
+class RateLimiter(object):
+    def __init__(self, settings=None):
+        self.settings = settings or {}
+        self._limits = {}
+        self._lock = threading.Lock()
+
+    def settings_for(self, service, operation):
+        settings = dict(DEFAULT_LIMITS)
+        for key in ['default', service, '{}.{}'.format(service, operation)]:
+            settings.update(self.settings.get(key) or {})
+        return settings
+
+    def limits_for(self, service, operation):
+        key = (service, operation)
+        with self._lock:
+            if key not in self._limits:
+                settings = self.settings_for(service, operation)
+                self._limits[key] = (TokenBucket(settings.get('rate'), settings.get('burst')),
+                                     AimdLimiter(settings.get('maxConcurrency'), settings.get('minConcurrency'),
+                                                 settings.get('increase'), settings.get('decrease'),
+                                                 settings.get('cooldown')))
+            return self._limits[key]
+
+    def _before_call(self, model, context, **kwargs):
+        bucket, concurrency = self.limits_for(model.service_model.service_name, model.name)
+        bucket.acquire()
+        concurrency.acquire()
+        context['glint_limit'] = concurrency
+
+    def _needs_retry(self, request_dict=None, response=None, operation=None, **kwargs):
+        # a throttled attempt botocore is about to retry still counts against the limit
+        concurrency = ((request_dict or {}).get('context') or {}).get('glint_limit')
+        code = response[1].get('Error', {}).get('Code') if response and response[1] else None
+        if concurrency and code in THROTTLE_CODES and concurrency.throttled():
+            print('Throttled by AWS, {}.{} now runs at most {} concurrent calls.'.format(
+                operation.service_model.service_name, operation.name, int(concurrency.limit)))
+        return None
+
+    def _after_call(self, parsed, context, **kwargs):
+        # error responses land here too, parsed into an Error dict
+        concurrency = context.pop('glint_limit', None) if context else None
+        if concurrency:
+            concurrency.release(throttled=(parsed or {}).get('Error', {}).get('Code') in THROTTLE_CODES)
+
+    def _after_call_error(self, exception, context, **kwargs):
+        concurrency = context.pop('glint_limit', None) if context else None
+        if concurrency:
+            concurrency.release(throttled=is_throttle(exception))
+
+    def instrument(self, events):
+        events.register('before-call.*.*', self._before_call, unique_id='glint-limit-before')
+        events.register('needs-retry.*.*', self._needs_retry, unique_id='glint-limit-retry')
+        events.register('after-call.*.*', self._after_call, unique_id='glint-limit-after')
+        events.register('after-call-error.*.*', self._after_call_error, unique_id='glint-limit-error')
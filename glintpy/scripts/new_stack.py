@@ -1,287 +1,458 @@
-from amaasinfra.data.data_setup import DatabaseSetter
-import boto3
-import json
-import os
-import pymysql
-import sys
 from random import choice
 from string import ascii_lowercase
-from time import sleep
+from .clients import ClientPool, compact
+from .config import load_config
+from .databases import provision_databases
+from .inventory import Inventory
+from .limits import is_throttle
+from .scheduler import TaskGraph
+from .seeding import seed_table
+from .state import CREATE, UNCHANGED, UPDATE, Change, StackState, print_plan
+from .tracing import span, traced
+from .waiters import WaiterHub
 
-def stack_automate(file):
-    file = os.path.abspath(os.path.expanduser(file))
+
+def create_vpc(ec2_cli, item, state=None):
+    if state and state.vpc_id(item):
+        print('VPC {} exists, skipping.'.format(item.get('cidrBlock')))
+        return state.vpc_id(item)
+
+    print('Creating VPC {}...'.format(item.get('cidrBlock')))
+    response = {}
+    if item.get('defaultVpc'):
+        response = ec2_cli.create_default_vpc()
+    else:
+        response = ec2_cli.create_vpc(**compact(dict(
+            CidrBlock=item.get('cidrBlock'),
+            AmazonProvidedIpv6CidrBlock=False,
+            InstanceTenancy=item.get('instanceTenancy'))))
+
+    return response.get('Vpc').get('VpcId')
+
+
+def create_subnets(ec2_cli, inventory, item, new_vpc_id):
+    print('Creating new subnets...')
+    subnet_ids = {}
+    for subnet_item in item.get('subnets'):
+        cidr = subnet_item.get('cidr')
+        existing = inventory.find('subnets', vpcCidr=(new_vpc_id, cidr))
+        if existing:
+            subnet_ids[cidr] = existing[0].get('SubnetId')
+            continue
+        print('Creating subnet {}...'.format(cidr))
+        subnet = ec2_cli.create_subnet(
+            AvailabilityZone=subnet_item.get('availabilityZone'),
+            CidrBlock=cidr,
+            VpcId=new_vpc_id)
+        subnet_ids[cidr] = inventory.add('subnets', subnet.get('Subnet')).get('SubnetId')
+    return subnet_ids
+
+
+def create_nat_gateways(ec2_cli, inventory, item, elastic_ip, waiters, vpc_id, state=None):
+    nats = [item for item in item.get('subnets') if item.get('nat')]
+
+    gateways = []
+    for nat in nats:
+        for subnet in inventory.find('subnets', vpcCidr=(vpc_id, nat.get('cidr'))):
+            if state and state.nat_gateway(subnet.get('SubnetId')):
+                gateways.append(waiters.watch('nat', state.nat_gateway(subnet.get('SubnetId')).get('NatGatewayId')))
+                continue
+            print('Creating NAT Gateway for subnet {}...'.format(subnet.get('SubnetId')))
+            response = ec2_cli.create_nat_gateway(AllocationId=elastic_ip.get('AllocationId'),
+                                                  SubnetId=subnet.get('SubnetId'))
+            gateways.append(waiters.watch('nat', response.get('NatGateway').get('NatGatewayId')))
+
+    with span('wait nat {}'.format(item.get('cidrBlock')), 'wait'):
+        return [gateway.result().get('NatGatewayId') for gateway in gateways]
+
+
+def create_security_groups(ec2_cli, inventory, item, new_vpc_id, state=None):
+    #creating security groups other than default group
+    group_ids = {}
+    for sg in item.get('securityGroups'):
+        if state and state.security_group_id(sg.get('name'), new_vpc_id):
+            group_ids[sg.get('name')] = state.security_group_id(sg.get('name'), new_vpc_id)
+            continue
+        response = ec2_cli.create_security_group(Description=sg.get('description'),
+                                                 GroupName=sg.get('name'),
+                                                 VpcId=new_vpc_id)
+        grp_id = response['GroupId']
+        group_ids[sg.get('name')] = grp_id
+        inventory.add('securityGroups', {'GroupId': grp_id,
+                                         'GroupName': sg.get('name'),
+                                         'Description': sg.get('description'),
+                                         'VpcId': new_vpc_id})
+        ec2_cli.authorize_security_group_ingress(GroupId=grp_id,
+                                                 GroupName=sg.get('name'),
+                                                 IpPermissions=sg.get('ingressRules'))
+    return group_ids
+
+
+def create_policy(client, item, state=None):
+    if state and item.get('name') in state.policies:
+        return
+
+    print('Creating new policy {}...'.format(item.get('name')))
     try:
-        with open(file) as data_file:
-            data = json.load(data_file)
+        client.create_policy(PolicyName=item.get('name'),
+                             Path=item.get('path', '/'),
+                             PolicyDocument=item.get('document'),
+                             Description=item.get('description', ''))
     except Exception as e:
-        print('Error. Unable to load the setting file.')
-        sys.exit()
+        if is_throttle(e):
+            raise
+        print(e)
 
-    print('Initializing AWS Stack services...')
 
-    # Creating new VPCs
-    ec2_res = boto3.resource('ec2',
-                             region_name=data.get('region', ''),
-                             aws_access_key_id=data.get('accessKey', ''),
-                             aws_secret_access_key=data.get('secretKey', ''))
+def create_role(client, item, state=None):
+    if state and item.get('roleName') in state.roles:
+        return
 
-    ec2_cli = ec2_res.meta.client
+    print('Creating new IAM role {}...'.format(item.get('roleName')))
+    try:
+        client.create_role(Path=item.get('path', '/'),
+                           RoleName=item.get('roleName'),
+                           AssumeRolePolicyDocument=item.get('assumedRole'),
+                           Description=item.get('description', ''))
 
-    elastic_ip = {}
-    if data.get('elasticIP'):
-        print('Creating Elastic IP...')
-        elastic_ip = ec2_cli.allocate_address(Domain='vpc')
+        for policy in item.get('policies'):
+            print('Attaching policy {} to IAM role {}...'.format(policy,
+                                                                 item.get('roleName')))
+            client.attach_role_policy(RoleName=item.get('roleName'),
+                                      PolicyArn=policy)
+            client.put_role_policy(RoleName=item.get('roleName'),
+                                   PolicyName=item.get('roleName')+ (''.join(choice(ascii_lowercase) for i in range(12))),
+                                   PolicyDocument=item.get('inlinePolicy'))
+    except Exception as e:
+        if is_throttle(e):
+            raise
+        print(e)
 
-    for item in data.get('vpcs'):
-        if not item.get('skip'):
-            print('Creating VPC {}...'.format(item.get('cidrBlock')))
-            response = {}
-            if item.get('defaultVpc'):
-                response = ec2_cli.create_default_vpc()
-            else:
-                response = ec2_cli.create_vpc(
-                    CidrBlock=item.get('cidrBlock'),
-                    AmazonProvidedIpv6CidrBlock=False,
-                    InstanceTenancy=item.get('instanceTenancy'))
-
-            new_vpc_id = response.get('Vpc').get('VpcId')
-            print('Creating new subnets...')
-            created_subnets = [item.get('CidrBlock') for item in ec2_cli.describe_subnets().get('Subnets')]
-            new_subnets = [item.get('cidr') for item in item.get('subnets')]
-
-            to_be_created_subnets = list(set(new_subnets) - set(created_subnets))
-            for cidr in to_be_created_subnets:
-                print('Creating subnet {}...'.format(cidr))
-                for subnet_item in item.get('subnets'):
-                    if cidr == subnet_item.get('cidr'):
-                        subnet = ec2_cli.create_subnet(
-                            AvailabilityZone=subnet_item.get('availabilityZone'),
-                            CidrBlock=cidr,
-                            VpcId=new_vpc_id)
 
-            if data.get('elasticIP'):
-                # once additional subnets been created, describe all subnets again and create NAT gateways
-                created_subnets = [item for item in ec2_cli.describe_subnets().get('Subnets')]
+def create_rds(client, inventory, item, waiters, state=None, subnet_vpcs=None, group_vpcs=None):
+    if state and item.get('identifier') in state.db_instances:
+        print('RDS instance {} exists, skipping.'.format(item.get('identifier')))
+        return waiters.wait('rds', item.get('identifier'), timeout=item.get('waitTimeout'))
+
+    print('Creating RDS subnet group...')
+    # CIDRs and group names may repeat across VPCs
+    subnet_vpcs, group_vpcs = subnet_vpcs or {}, group_vpcs or {}
+    subnet_ids = [sub_item.get('SubnetId') for cidr in item.get('subnetGroupSubnets')
+                  for sub_item in (inventory.find('subnets', vpcCidr=(subnet_vpcs[cidr], cidr)) if cidr in subnet_vpcs
+                                   else inventory.find('subnets', cidr=cidr))]
+
+    security_grp_ids = [sub_item.get('GroupId') for name in item.get('securityGroups')
+                        for sub_item in (inventory.find('securityGroups', name=name, vpc=group_vpcs[name])
+                                         if name in group_vpcs else inventory.find('securityGroups', name=name))]
+    if not (state and item.get('subnetGroup') in state.db_subnet_groups):
+        client.create_db_subnet_group(
+            DBSubnetGroupName=item.get('subnetGroup'),
+            DBSubnetGroupDescription='{} Subnet Group'.format(item.get('subnetGroup')),
+            SubnetIds=subnet_ids
+        )
+    response = client.create_db_instance(**compact(dict(DBInstanceIdentifier=item.get('identifier'),
+                                                       AllocatedStorage=item.get('allocatedStorage'),
+                                                       DBInstanceClass=item.get('instanceClass'),
+                                                       Engine=item.get('engine'),
+                                                       EngineVersion=item.get('engineVersion'),
+                                                       LicenseModel=item.get('licenseModel'),
+                                                       MasterUsername=item.get('username'),
+                                                       MasterUserPassword=item.get('password'),
+                                                       VpcSecurityGroupIds=security_grp_ids,
+                                                       StorageEncrypted=item.get('storageEncrypted'),
+                                                       #AvailabilityZone=item.get('availabilityZone'),
+                                                       DBSubnetGroupName=item.get('subnetGroup'),
+                                                       PreferredBackupWindow=item.get('backupWindow'),
+                                                       BackupRetentionPeriod=item.get('backupRetentionPeriod'),
+                                                       Port=item.get('port'),
+                                                       MultiAZ=item.get('multipleAZ'),
+                                                       AutoMinorVersionUpgrade=item.get('autoMinorVersionUpgrade'),
+                                                       PubliclyAccessible=item.get('publiclyAccessible'),
+                                                       StorageType=item.get('storageType'))))
+
+    print('Waiting for endpoint to be ready, this may take a while...')
+    db_identifier = response.get('DBInstance').get('DBInstanceIdentifier')
+    new_db_endpoint = waiters.wait('rds', db_identifier, timeout=item.get('waitTimeout'))
+
+    #check if replication required
+    if item.get('requireReplication'):
+        """This needs better implementation to handle both encrypted and non-encrypted source instances"""
+        # print('Creating DB replication...')
+        # print(client.create_db_instance_read_replica(DBInstanceIdentifier=item.get('identifier')+'-replica',
+        #                                              SourceDBInstanceIdentifier=item.get('identifier'),
+        #                                              DBInstanceClass=item.get('instanceClass'),
+        #                                              AvailabilityZone=item.get('availabilityZone'),
+        #                                              Port=item.get('port'),
+        #                                              AutoMinorVersionUpgrade=item.get('autoMinorVersionUpgrade'),
+        #                                              PubliclyAccessible=item.get('publiclyAccessible'),
+        #                                              Tags=[{'Key': 'Name',
+        #                                                     'Value': item.get('identifier')+'-replica'}],
+        #                                              StorageType=item.get('storageType'),
+        #                                              CopyTagsToSnapshot=True,
+        #                                              SourceRegion=data.get('region', '')))
+
+    return new_db_endpoint
+
+
+def setup_databases(item, endpoint):
+    failures = provision_databases(endpoint, item.get('username'), item.get('password'),
+                                   item.get('databases'),
+                                   workers=item.get('dbParallelism', 4),
+                                   port=item.get('port', 3306))
+    if failures:
+        raise RuntimeError('Unable to set up schemas {}'.format(', '.join(failures)))
+
+
+def alarm_params(data, item):
+    dimensions = []
+    for dim in item.get('dimensions'):
+        dimensions.append({'Name': dim.get('name'), 'Value': dim.get('value')})
+
+    return compact(dict(AlarmName=item.get('name'),
+                        AlarmDescription=item.get('description'),
+                        ActionsEnabled=item.get('enabled'),
+                        AlarmActions=["arn:aws:sns:{}:{}:{}".format(data.get('region'), data.get('awsClientID'), item.get('alarmAction')[0])],
+                        MetricName=item.get('metricName'),
+                        Namespace=item.get('namespace'),
+                        Statistic=item.get('statistic'),
+                        Dimensions=dimensions,
+                        Period=item.get('period'),
+                        Unit=item.get('unit'),
+                        EvaluationPeriods=item.get('evaluationPeriods'),
+                        Threshold=item.get('threshold'),
+                        ComparisonOperator=item.get('comparisonOperator')))
+
+
+def create_alarm(client, data, item, state=None):
+    params = alarm_params(data, item)
+    if state and state.alarm_changes(params) == []:
+        return
+
+    print('Creating CloudWatch alarm {}...'.format(item.get('name')))
+    client.put_metric_alarm(**params)
+
+
+def create_topic(client, item, state=None):
+    if state and item.get('name') in state.topics:
+        return state.topics[item.get('name')]
+
+    print('Creating SNS topic {}...'.format(item.get('name')))
+    return client.create_topic(Name=item.get('name')).get('TopicArn')
+
+
+def create_dynamodb(client, item, waiters, state=None):
+    changes = state.table_changes(item) if state else None
+    if changes == []:
+        return
+    if changes:
+        print('Updating dynamoDB {}...'.format(item.get('name')))
+        client.update_table(TableName=item.get('name'),
+                            ProvisionedThroughput={'ReadCapacityUnits': item.get('provisionedThroughput').get('readCapacityUnits'),
+                                                   'WriteCapacityUnits': item.get('provisionedThroughput').get('writeCapacityUnits')})
+        waiters.wait('dynamodb', item.get('name'))
+        return
+
+    print('Creating dynamoDB {}...'.format(item.get('name')))
+    try:
+        client.create_table(AttributeDefinitions=[{'AttributeName': attr.get('name'),
+                                                   'AttributeType': attr.get('type')} for attr in item.get('attributeDefinitions')],
+                            TableName=item.get('name'),
+                            KeySchema=[{'AttributeName': attr.get('name'),
+                                        'KeyType': attr.get('type')} for attr in item.get('keySchema')],
+                            ProvisionedThroughput={'ReadCapacityUnits': item.get('provisionedThroughput').get('readCapacityUnits'),
+                                                   'WriteCapacityUnits': item.get('provisionedThroughput').get('writeCapacityUnits')})
 
-                nats = [item for item in item.get('subnets') if item.get('nat')]
+    except Exception as e:
+        if is_throttle(e):
+            raise
+        print(e)
+        return
+
+    table = waiters.wait('dynamodb', item.get('name'))
+    print('DynamoDB {} is active'.format(item.get('name')))
+    if item.get('seedFile'):
+        # only a newly created table is seeded, existing data is left alone
+        seeder = seed_table(client, item, table)
+        if seeder.failed:
+            raise RuntimeError('Unable to seed {} items into {}'.format(seeder.failed, item.get('name')))
 
-                for nat in nats:
-                    for subnet in created_subnets:
-                        if nat.get('cidr') == subnet.get('CidrBlock'):
-                            print('Creating NAT Gateway for subnet {}...'.format(subnet.get('SubnetId')))
-                            ec2_cli.create_nat_gateway(AllocationId=elastic_ip.get('AllocationId'),
-                                                       SubnetId=subnet.get('SubnetId'))
 
-            #creating security groups other than default group
+def plan_stack(data, state):
+    changes = []
+    for item in data.get('vpcs'):
+        if not item.get('skip'):
+            vpc_id = state.vpc_id(item)
+            changes.append(Change(UNCHANGED if vpc_id else CREATE, 'vpc', item.get('cidrBlock'), vpc_id))
+            for subnet in item.get('subnets'):
+                exists = vpc_id and state.inventory.find('subnets', vpcCidr=(vpc_id, subnet.get('cidr')))
+                changes.append(Change(UNCHANGED if exists else CREATE, 'subnet', subnet.get('cidr'), ''))
+                if subnet.get('nat') and data.get('elasticIP'):
+                    nat = exists and state.nat_gateway(exists[0].get('SubnetId'))
+                    changes.append(Change(UNCHANGED if nat else CREATE, 'natGateway', subnet.get('cidr'), ''))
             for sg in item.get('securityGroups'):
-                response = ec2_cli.create_security_group(Description=sg.get('description'),
-                                                            GroupName=sg.get('name'),
-                                                            VpcId=new_vpc_id)
-                grp_id = response['GroupId']
-                ec2_cli.authorize_security_group_ingress(GroupId=grp_id,
-                                                        GroupName=sg.get('name'),
-                                                        IpPermissions=sg.get('ingressRules'))
-
-    #Createing IAM roles and custom policies    
-    client = boto3.client('iam',
-                          region_name=data.get('region', ''),
-                          aws_access_key_id=data.get('accessKey', ''),
-                          aws_secret_access_key=data.get('secretKey', ''))
+                exists = vpc_id and state.security_group_id(sg.get('name'), vpc_id)
+                changes.append(Change(UNCHANGED if exists else CREATE, 'securityGroup', sg.get('name'), ''))
+
     for item in data.get('customPolicies'):
-        print('Creating new policy {}...'.format(item.get('name')))
-        try:
-            client.create_policy(PolicyName=item.get('name'),
-                                 Path=item.get('path', '/'),
-                                 PolicyDocument=item.get('document'),
-                                 Description=item.get('description', ''))
-        except Exception as e:
-            print(e)
-            continue
+        changes.append(Change(UNCHANGED if item.get('name') in state.policies else CREATE,
+                              'policy', item.get('name'), ''))
 
-    
     for item in data.get('iamRoles'):
-        print('Creating new IAM role {}...'.format(item.get('roleName')))
-        try:
-            client.create_role(Path=item.get('path', '/'),
-                                RoleName=item.get('roleName'),
-                                AssumeRolePolicyDocument=item.get('assumedRole'),
-                                Description=item.get('description', ''))
-
-            for policy in item.get('policies'):
-                print('Attaching policy {} to IAM role {}...'.format(policy,
-                                                                     item.get('roleName')))
-                client.attach_role_policy(RoleName=item.get('roleName'),
-                                          PolicyArn=policy)
-                client.put_role_policy(RoleName=item.get('roleName'),
-                                       PolicyName=item.get('roleName')+ (''.join(choice(ascii_lowercase) for i in range(12))),
-                                       PolicyDocument=item.get('inlinePolicy'))
-        except Exception as e:
-            print(e)
-            continue
-
-    # Creating new RDS
-    client = boto3.client('rds',
-                          region_name=data.get('region', ''),
-                          aws_access_key_id=data.get('accessKey', ''),
-                          aws_secret_access_key=data.get('secretKey', ''))
+        changes.append(Change(UNCHANGED if item.get('roleName') in state.roles else CREATE,
+                              'role', item.get('roleName'), ''))
 
     for item in data.get('rds'):
         if not item.get('skip'):
-            print('Creating RDS subnet group...')  
-            subnet_ids = [sub_item.get('SubnetId') for sub_item in ec2_cli.describe_subnets(Filters=[{'Name': 'cidrBlock', 'Values': item.get('subnetGroupSubnets')}]).get('Subnets')]
-
-            security_grp_ids = [sub_item.get('GroupId') for sub_item in ec2_cli.describe_security_groups(Filters=[{'Name': 'group-name', 'Values': item.get('securityGroups')}]).get('SecurityGroups')]
-            client.create_db_subnet_group(
-                DBSubnetGroupName=item.get('subnetGroup'),
-                DBSubnetGroupDescription='{} Subnet Group'.format(item.get('subnetGroup')),
-                SubnetIds=subnet_ids
-            )
-            response = client.create_db_instance(DBInstanceIdentifier=item.get('identifier'),
-                                                 AllocatedStorage=item.get('allocatedStorage'),
-                                                 DBInstanceClass=item.get('instanceClass'),
-                                                 Engine=item.get('engine'),
-                                                 EngineVersion=item.get('engineVersion'),
-                                                 LicenseModel=item.get('licenseModel'),
-                                                 MasterUsername=item.get('username'),
-                                                 MasterUserPassword=item.get('password'),
-                                                 VpcSecurityGroupIds=security_grp_ids,
-                                                 StorageEncrypted=item.get('storageEncrypted'),
-                                                 #AvailabilityZone=item.get('availabilityZone'),
-                                                 DBSubnetGroupName=item.get('subnetGroup'),
-                                                 PreferredBackupWindow=item.get('backupWindow'),
-                                                 BackupRetentionPeriod=item.get('backupRetentionPeriod'),
-                                                 Port=item.get('port'),
-                                                 MultiAZ=item.get('multipleAZ'),
-                                                 AutoMinorVersionUpgrade=item.get('autoMinorVersionUpgrade'),
-                                                 PubliclyAccessible=item.get('publiclyAccessible'),
-                                                 StorageType=item.get('storageType'))
-
-            print('Waiting for endpoint to be ready, this may take a while...')
-            new_db_endpoint = ''
-            db_identifier = response.get('DBInstance').get('DBInstanceIdentifier')
-            while True:
-                sleep(5)
-                print('Checking for new endpoint...')
-                the_instance = client.describe_db_instances(DBInstanceIdentifier=db_identifier).get('DBInstances')[0]
-                if the_instance.get('Endpoint', None):
-                    new_db_endpoint = the_instance.get('Endpoint').get('Address')
-                    break
-            
-            #check if replication required
-            if item.get('requireReplication'):
-                """This needs better implementation to handle both encrypted and non-encrypted source instances"""
-                # print('Creating DB replication...')
-                # print(client.create_db_instance_read_replica(DBInstanceIdentifier=item.get('identifier')+'-replica',
-                #                                              SourceDBInstanceIdentifier=item.get('identifier'),
-                #                                              DBInstanceClass=item.get('instanceClass'),
-                #                                              AvailabilityZone=item.get('availabilityZone'),
-                #                                              Port=item.get('port'),
-                #                                              AutoMinorVersionUpgrade=item.get('autoMinorVersionUpgrade'),
-                #                                              PubliclyAccessible=item.get('publiclyAccessible'),
-                #                                              Tags=[{'Key': 'Name',
-                #                                                     'Value': item.get('identifier')+'-replica'}],
-                #                                              StorageType=item.get('storageType'),
-                #                                              CopyTagsToSnapshot=True,                                                
-                #                                              SourceRegion=data.get('region', '')))
-
-            db_setter = DatabaseSetter()
-            for db in item.get('databases'):
-                db_config={'db_server': new_db_endpoint,
-                           'db_username': item.get('username'),
-                           'db_password': item.get('password'),
-                           'ignore': ['.DS_Store'],
-                           'table_path': db.get('tablePath') if os.path.isabs(db.get('tablePath')) \
-                                         else os.path.abspath(os.path.expanduser(db.get('tablePath')))}
-                if db.get('dataPath', None):
-                    db_config.update({'data_path': db.get('dataPath') if os.path.isabs(db.get('dataPath')) \
-                                      else os.path.abspath(os.path.expanduser(db.get('dataPath')))})
-                db_setter.recreate(schema=db.get('name'), environment='automation', db_config=db_config)
-                db_setter.recreate(schema='unittest_'+db.get('name'), environment='automation', 
-                                   db_config=db_config)
+            exists = item.get('identifier') in state.db_instances
+            changes.append(Change(UNCHANGED if exists else CREATE, 'rds', item.get('identifier'),
+                                  '' if exists else 'databases will be created'))
         elif item.get('endpoint'):
-            db_setter = DatabaseSetter()
-            for db in item.get('databases'):
-                db_config={'db_server': item.get('endpoint'),
-                           'db_username': item.get('username'),
-                           'db_password': item.get('password'),
-                           'ignore': ['.DS_Store'],
-                           'table_path': db.get('tablePath') if os.path.isabs(db.get('tablePath')) \
-                                         else os.path.abspath(os.path.expanduser(db.get('tablePath')))}
-                if db.get('dataPath', None):
-                    db_config.update({'data_path': db.get('dataPath') if os.path.isabs(db.get('dataPath')) \
-                                      else os.path.abspath(os.path.expanduser(db.get('dataPath')))})
-
-                db_setter.recreate(schema=db.get('name'), environment='automation', 
-                                   db_config=db_config)                
-                db_setter.recreate(schema='unittest_'+db.get('name'), environment='automation', 
-                                   db_config=db_config)
-                
-    #start to handle CloudWatch alarms here
-    client = boto3.client('cloudwatch',
-                          region_name=data.get('region', ''),
-                          aws_access_key_id=data.get('accessKey', ''),
-                          aws_secret_access_key=data.get('secretKey', ''))
-
-    
-    
+            changes.append(Change(UPDATE, 'rds', item.get('identifier') or item.get('endpoint'),
+                                  'databases will be recreated'))
+
+    for item in data.get('sns'):
+        if not item.get('skip'):
+            changes.append(Change(UNCHANGED if item.get('name') in state.topics else CREATE,
+                                  'sns', item.get('name'), ''))
+
     for item in data.get('cloudWatch').get('alarms'):
         if not item.get('skip'):
-            print('Creating CloudWatch alarm {}...'.format(item.get('name')))
-            dimensions = []
-            for dim in item.get('dimensions'):
-                dimensions.append({'Name': dim.get('name'), 'Value': dim.get('value')})
-
-            client.put_metric_alarm(AlarmName=item.get('name'),
-                                    AlarmDescription=item.get('description'),
-                                    ActionsEnabled=item.get('enabled'),
-                                    AlarmActions=["arn:aws:sns:{}:{}:{}".format(data.get('region'), data.get('awsClientID'), item.get('alarmAction')[0])],
-                                    MetricName=item.get('metricName'),
-                                    Namespace=item.get('namespace'),
-                                    Statistic=item.get('statistic'),
-                                    Dimensions=dimensions,
-                                    Period=item.get('period'),
-                                    Unit=item.get('unit'),
-                                    EvaluationPeriods=item.get('evaluationPeriods'),
-                                    Threshold=item.get('threshold'),
-                                    ComparisonOperator=item.get('comparisonOperator'))
-        
-    #start to handle SNS here
-    client = boto3.client('sns',
-                          region_name=data.get('region', ''),
-                          aws_access_key_id=data.get('accessKey', ''),
-                          aws_secret_access_key=data.get('secretKey', ''))
+            diff = state.alarm_changes(alarm_params(data, item))
+            changes.append(Change(CREATE if diff is None else (UPDATE if diff else UNCHANGED),
+                                  'alarm', item.get('name'), ', '.join(diff or [])))
+
+    for item in data.get('dynamoDBs'):
+        if not item.get('skip'):
+            diff = state.table_changes(item)
+            changes.append(Change(CREATE if diff is None else (UPDATE if diff else UNCHANGED),
+                                  'dynamodb', item.get('name'), ', '.join(diff or [])))
+
+    return changes
+
+
+def build_stack_graph(data, clients, waiters, inventory, state=None):
+    graph = TaskGraph()
+    ec2_cli = clients['ec2']
+
+    if data.get('elasticIP'):
+        def allocate_address(results):
+            if state and all(change.action == UNCHANGED for change in plan_stack(data, state)
+                             if change.kind == 'natGateway'):
+                # every NAT gateway already exists, so no new address is needed
+                return {}
+            print('Creating Elastic IP...')
+            return ec2_cli.allocate_address(Domain='vpc')
+        graph.add('elasticIP', allocate_address)
+
+    network_tasks, subnet_vpcs, group_vpcs = [], {}, {}
+    for index, item in enumerate(data.get('vpcs')):
+        if not item.get('skip'):
+            vpc = 'vpc[{}]'.format(index)
+            for subnet in item.get('subnets'):
+                subnet_vpcs.setdefault(subnet.get('cidr'), vpc)
+            for sg in item.get('securityGroups'):
+                group_vpcs.setdefault(sg.get('name'), vpc)
+            graph.add(vpc, lambda results, item=item: create_vpc(ec2_cli, item, state))
+            subnets = graph.add(vpc + '.subnets',
+                                lambda results, item=item, vpc=vpc: create_subnets(ec2_cli, inventory, item, results[vpc]),
+                                deps=[vpc])
+            groups = graph.add(vpc + '.securityGroups',
+                               lambda results, item=item, vpc=vpc: create_security_groups(ec2_cli, inventory, item, results[vpc], state),
+                               deps=[vpc])
+            network_tasks.extend([subnets, groups])
+
+            if data.get('elasticIP'):
+                graph.add(vpc + '.natGateways',
+                          lambda results, item=item, vpc=vpc: create_nat_gateways(ec2_cli, inventory, item, results['elasticIP'], waiters, results[vpc], state),
+                          deps=[subnets, 'elasticIP'])
+
+    policy_tasks = [graph.add('policy:{}'.format(item.get('name')),
+                              lambda results, item=item: create_policy(clients['iam'], item, state))
+                    for item in data.get('customPolicies')]
+
+    for item in data.get('iamRoles'):
+        # roles may attach any of the custom policies
+        graph.add('role:{}'.format(item.get('roleName')),
+                  lambda results, item=item: create_role(clients['iam'], item, state),
+                  deps=policy_tasks)
 
+    for item in data.get('rds'):
+        rds = 'rds:{}'.format(item.get('identifier'))
+        if not item.get('skip'):
+            graph.add(rds,
+                      lambda results, item=item: create_rds(clients['rds'], inventory, item, waiters, state,
+                                                            {cidr: results[vpc] for cidr, vpc in subnet_vpcs.items()},
+                                                            {name: results[vpc] for name, vpc in group_vpcs.items()}),
+                      deps=network_tasks)
+            if not (state and item.get('identifier') in state.db_instances):
+                # an existing instance keeps its data on apply
+                graph.add(rds + '.databases',
+                          lambda results, item=item, rds=rds: setup_databases(item, results[rds]),
+                          deps=[rds])
+        elif item.get('endpoint'):
+            graph.add(rds + '.databases',
+                      lambda results, item=item: setup_databases(item, item.get('endpoint')))
+
+    topics = set()
     for item in data.get('sns'):
         if not item.get('skip'):
-            print('Creating SNS topic {}...'.format(item.get('name')))
-            client.create_topic(Name=item.get('name'))
+            topics.add(graph.add('sns:{}'.format(item.get('name')),
+                                 lambda results, item=item: create_topic(clients['sns'], item, state)))
 
-    #start to handle DynamoDB here
-    client = boto3.client('dynamodb',
-                          region_name=data.get('region', ''),
-                          aws_access_key_id=data.get('accessKey', ''),
-                          aws_secret_access_key=data.get('secretKey', ''))
+    for item in data.get('cloudWatch').get('alarms'):
+        if not item.get('skip'):
+            deps = ['sns:{}'.format(action) for action in item.get('alarmAction', [])]
+            graph.add('alarm:{}'.format(item.get('name')),
+                      lambda results, item=item: create_alarm(clients['cloudwatch'], data, item, state),
+                      deps=[dep for dep in deps if dep in topics])
 
     for item in data.get('dynamoDBs'):
         if not item.get('skip'):
-            print('Creating dynamoDB {}...'.format(item.get('name')))
-            try:
-                client.create_table(AttributeDefinitions=[{'AttributeName': attr.get('name'),
-                                                        'AttributeType': attr.get('type')} for attr in item.get('attributeDefinitions')],
-                                    TableName=item.get('name'),
-                                    KeySchema=[{'AttributeName': attr.get('name'),
-                                                'KeyType': attr.get('type')} for attr in item.get('keySchema')],
-                                    ProvisionedThroughput={'ReadCapacityUnits': item.get('provisionedThroughput').get('readCapacityUnits'),
-                                                        'WriteCapacityUnits': item.get('provisionedThroughput').get('writeCapacityUnits')})
-
-            except Exception as e:
-                print(e)
-                continue
+            graph.add('dynamodb:{}'.format(item.get('name')),
+                      lambda results, item=item: create_dynamodb(clients['dynamodb'], item, waiters, state))
+
+    return graph
+
+
+@traced('stack_automate')
+def stack_automate(file, jobs=None, apply=False, plan_only=False, journal=None):
+    data = load_config(file)
+
+    print('Initializing AWS Stack services...')
+
+    pool = ClientPool.from_config(data)
+    clients = {service: pool.client(service)
+               for service in ['ec2', 'iam', 'rds', 'cloudwatch', 'sns', 'dynamodb']}
+
+    jobs = jobs or data.get('stackParallelism', 1)
+    inventory = Inventory(clients['ec2'])
+    state = None
+    if apply or plan_only:
+        print('Reading current stack state...')
+        with span('read stack state', 'state'):
+            state = StackState(clients, inventory).load(data)
+        print_plan(plan_stack(data, state))
+        if plan_only:
+            return
+
+    with WaiterHub({'rds': clients['rds'], 'nat': clients['ec2'], 'dynamodb': clients['dynamodb']},
+                   data.get('waiters')) as waiters:
+        graph = build_stack_graph(data, clients, waiters, inventory, state)
+        replayed = [name for name in graph.tasks if journal and name in journal.completed]
+        if replayed:
+            print('Skipping {} steps finished in the journaled run: {}'.format(len(replayed), ', '.join(replayed)))
+        results, failed, skipped = graph.run(max_workers=jobs,
+                                             completed=journal.completed if journal else None,
+                                             on_complete=journal.record if journal else None)
+
+    if failed:
+        raise RuntimeError('Stack deployment failed at {}, skipped {}'.format(', '.join(failed),
+                                                                              ', '.join(skipped) or 'nothing'))
 
-    # # start to handle SQS here    
+    # # start to handle SQS here
     # client = boto3.client('sqs',
     #                       region_name=data.get('region', ''),
     #                       aws_access_key_id=data.get('accessKey', ''),
     #                       aws_secret_access_key=data.get('secretKey', ''))
 
-    # for item in data.get('sqs'):
\ No newline at end of file
+    # for item in data.get('sqs'):
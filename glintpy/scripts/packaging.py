@@ -0,0 +1,47 @@
+import base64
+import hashlib
+import os
+import shutil
+import stat
+import zipfile
+
+# earliest timestamp a zip entry can carry, given to every entry
+ZIP_EPOCH = (1980, 1, 1, 0, 0, 0)
+
+
+def walk_tree(root, prefix=''):
+    for dirpath, dirnames, filenames in os.walk(root):
+        # compiled files carry their source mtime, so they would change the zip on every install
+        dirnames[:] = sorted(name for name in dirnames if name != '__pycache__')
+        rel = os.path.relpath(dirpath, root)
+        for name in sorted(filenames):
+            arcname = name if rel == '.' else '/'.join(rel.split(os.sep) + [name])
+            yield prefix + arcname, os.path.join(dirpath, name)
+
+
+def build_zip(zip_file, entries, compression=zipfile.ZIP_DEFLATED, compresslevel=None):
+    entries = sorted(set(entries))
+    with zipfile.ZipFile(zip_file, 'w', compression=compression,
+                         compresslevel=compresslevel) as zf:
+        for arcname, path in entries:
+            info = zipfile.ZipInfo(arcname, date_time=ZIP_EPOCH)
+            info.compress_type = compression
+            info.create_system = 3
+            mode = 0o755 if os.stat(path).st_mode & stat.S_IXUSR else 0o644
+            info.external_attr = (stat.S_IFREG | mode) << 16
+            with open(path, 'rb') as src, zf.open(info, 'w') as dest:
+                shutil.copyfileobj(src, dest, 1024 * 1024)
+    return zip_file
+
+
+def hash_file(path, digest=None):
+    digest = digest or hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b''):
+            digest.update(chunk)
+    return digest
+
+
+def code_sha256(zip_file):
+    # same encoding as the CodeSha256 reported by the lambda API
+    return base64.b64encode(hash_file(zip_file).digest()).decode('utf-8')
@@ -0,0 +1,76 @@
+from collections import OrderedDict
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from .tracing import span
+
+
+def _run_task(name, fn, results):
+    with span(name, 'task'):
+        return fn(results)
+
+
+class TaskGraph(object):
+    def __init__(self):
+        self.tasks = OrderedDict()
+
+    def add(self, name, fn, deps=()):
+        if name in self.tasks:
+            raise KeyError('Duplicated task {}'.format(name))
+        self.tasks[name] = (fn, list(deps))
+        return name
+
+    def validate(self):
+        for name, (fn, deps) in self.tasks.items():
+            for dep in deps:
+                if dep not in self.tasks:
+                    raise KeyError('Task {} depends on unknown task {}'.format(name, dep))
+
+        # Kahn's algorithm, anything left over sits on a cycle
+        indegree = {name: len(deps) for name, (fn, deps) in self.tasks.items()}
+        dependents = {name: [] for name in self.tasks}
+        for name, (fn, deps) in self.tasks.items():
+            for dep in deps:
+                dependents[dep].append(name)
+        ready = [name for name, count in indegree.items() if not count]
+        while ready:
+            for dependent in dependents[ready.pop()]:
+                indegree[dependent] -= 1
+                if not indegree[dependent]:
+                    ready.append(dependent)
+        cyclic = [name for name, count in indegree.items() if count]
+        if cyclic:
+            raise ValueError('Tasks {} form a dependency cycle'.format(', '.join(cyclic)))
+
+    def run(self, max_workers=1, completed=None, on_complete=None):
+        # tasks in completed are not run again
+        self.validate()
+        results = {name: result for name, result in (completed or {}).items() if name in self.tasks}
+        failed, skipped = OrderedDict(), []
+        pending = OrderedDict((name, task) for name, task in self.tasks.items() if name not in results)
+        running = {}
+
+        with ThreadPoolExecutor(max_workers=max(max_workers, 1)) as pool:
+            while pending or running:
+                for name, (fn, deps) in list(pending.items()):
+                    if any(dep in failed or dep in skipped for dep in deps):
+                        print('Skipping {}, a dependency failed.'.format(name))
+                        skipped.append(name)
+                        del pending[name]
+                    elif all(dep in results for dep in deps) and len(running) < max_workers:
+                        running[pool.submit(_run_task, name, fn, results)] = name
+                        del pending[name]
+
+                if not running:
+                    continue
+
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    name = running.pop(future)
+                    try:
+                        results[name] = future.result()
+                        if on_complete:
+                            on_complete(name, results[name])
+                    except Exception as e:
+                        print('Error. {} failed: {}'.format(name, e))
+                        failed[name] = e
+
+        return results, failed, skipped
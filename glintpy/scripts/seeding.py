@@ -0,0 +1,116 @@
+import csv
+import json
+import math
+import os
+import random
+import time
+from boto3.dynamodb.types import TypeSerializer
+from botocore.exceptions import ClientError
+from decimal import Decimal
+from .batching import BatchWorkers
+from .limits import TokenBucket, is_throttle
+
+BATCH_SIZE = 25
+DEFAULT_SEGMENTS = 4
+MAX_RETRIES = 8
+MAX_BACKOFF = 20
+
+
+def read_seed(file_path, attribute_types=None):
+    attribute_types = attribute_types or {}
+    with open(file_path, newline='') as seed_file:
+        if os.path.splitext(file_path)[1].lower() == '.csv':
+            for row in csv.DictReader(seed_file):
+                yield {key: Decimal(value) if attribute_types.get(key) == 'N' else value
+                       for key, value in row.items() if key and value != ''}
+        else:
+            for line in seed_file:
+                if line.strip():
+                    yield json.loads(line, parse_float=Decimal)
+
+
+def write_units(request):
+    # a write costs one unit per started KB of the item
+    return max(1, int(math.ceil(len(json.dumps(request, default=str)) / 1024.0)))
+
+
+class TableSeeder(BatchWorkers):
+    def __init__(self, client, table_name, write_capacity=None, segments=DEFAULT_SEGMENTS):
+        super().__init__(segments, name='glint-seed')
+        self.client = client
+        self.table_name = table_name
+        # refilled at the table's write capacity per second, shared by every segment
+        self.throttle = TokenBucket(write_capacity)
+        self.written = 0
+        self.retries = 0
+
+    def size(self, requests):
+        return len(requests)
+
+    def _write(self, requests):
+        attempt = 0
+        while requests:
+            self.throttle.acquire(sum(write_units(request) for request in requests))
+            try:
+                response = self.client.batch_write_item(RequestItems={self.table_name: requests})
+                unprocessed = response.get('UnprocessedItems', {}).get(self.table_name, [])
+            except ClientError as e:
+                if not is_throttle(e):
+                    raise
+                unprocessed = requests
+
+            with self._lock:
+                self.written += len(requests) - len(unprocessed)
+            if not unprocessed:
+                return 0
+            attempt += 1
+            if attempt > MAX_RETRIES:
+                return len(unprocessed)
+            with self._lock:
+                self.retries += 1
+            time.sleep(random.uniform(0, min(MAX_BACKOFF, 0.05 * 2 ** attempt)))
+            requests = unprocessed
+        return 0
+
+    def process(self, requests):
+        failed = self._write(requests)
+        return failed, '{} items still unprocessed after {} retries'.format(failed, MAX_RETRIES) if failed else None
+
+    def stats(self):
+        elapsed = self.elapsed()
+        return '{}: {} items written, {} failed, {} retries in {:.1f}s ({:.0f} items/s)'.format(
+            self.table_name, self.written, self.failed, self.retries, elapsed, self.written / elapsed)
+
+
+def seed_table(client, item, table=None, log=print):
+    file_path = os.path.abspath(os.path.expanduser(item.get('seedFile')))
+    key_names = [key.get('name') for key in item.get('keySchema')]
+    attribute_types = {attr.get('name'): attr.get('type') for attr in item.get('attributeDefinitions')}
+    write_capacity = (table or {}).get('ProvisionedThroughput', {}).get('WriteCapacityUnits') or \
+        item.get('provisionedThroughput', {}).get('writeCapacityUnits')
+    if (table or {}).get('BillingModeSummary', {}).get('BillingMode') == 'PAY_PER_REQUEST':
+        write_capacity = None
+
+    log('Seeding dynamoDB {} from {}...'.format(item.get('name'), file_path))
+    serializer = TypeSerializer()
+    seeder = TableSeeder(client, item.get('name'), write_capacity=write_capacity,
+                         segments=item.get('seedSegments', DEFAULT_SEGMENTS)).start()
+    try:
+        batch, keys = [], set()
+        for record in read_seed(file_path, attribute_types):
+            key = tuple(str(record.get(name)) for name in key_names)
+            if key in keys or len(batch) == BATCH_SIZE:
+                # batch_write_item rejects two writes to the same key in one call
+                seeder.submit(batch)
+                batch, keys = [], set()
+            batch.append({'PutRequest': {'Item': {name: serializer.serialize(value)
+                                                  for name, value in record.items()}}})
+            keys.add(key)
+        if batch:
+            seeder.submit(batch)
+    finally:
+        seeder.close()
+    log(seeder.stats())
+    for error in seeder.errors:
+        log('Error. {}'.format(error))
+    return seeder
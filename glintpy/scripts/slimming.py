@@ -0,0 +1,113 @@
+import fnmatch
+import json
+import os
+import re
+import shutil
+import subprocess
+import sys
+
+DEFAULT_EXCLUDES = ['__pycache__/*', '*.pyc', '*.pyo', '*.dist-info/*', '*.egg-info/*',
+                    'tests/*', 'test/*', 'docs/*', '*.h', '*.c', '*.pyx', '*.md', '*.rst']
+
+# compiles (source, target) pairs read from stdin, run with the target interpreter
+_COMPILE_SCRIPT = ('import json, py_compile, sys\n'
+                   'for src, dst in json.load(sys.stdin):\n'
+                   '    py_compile.compile(src, cfile=dst, dfile=src, doraise=True,\n'
+                   '                       invalidation_mode=py_compile.PycInvalidationMode.UNCHECKED_HASH)\n')
+
+
+def slimming_config(data, item):
+    config = dict(data.get('slimming', {}))
+    config.update(item.get('slimming', {}))
+    return config if config.get('enabled') else None
+
+
+def _matches(arcname, pattern):
+    # 'tests/*' also matches 'somepackage/tests/test_x.py'
+    parts = arcname.split('/')
+    return any(fnmatch.fnmatchcase('/'.join(parts[i:]), pattern) for i in range(len(parts)))
+
+
+def exclude_entries(entries, config, keep=()):
+    excludes = config.get('exclude', DEFAULT_EXCLUDES)
+    prune = config.get('prune', {})
+    kept = []
+    for arcname, path in entries:
+        if arcname not in keep:
+            if any(_matches(arcname, pattern) for pattern in excludes):
+                continue
+            package, _, rest = arcname.partition('/')
+            if rest and any(fnmatch.fnmatchcase(rest, pattern) for pattern in prune.get(package, [])):
+                continue
+        kept.append((arcname, path))
+    return kept
+
+
+def runtime_version(runtime):
+    match = re.match(r'python(\d+)\.(\d+)$', (runtime or '').lower())
+    return (int(match.group(1)), int(match.group(2))) if match else None
+
+
+def interpreter_version(python):
+    output = subprocess.run([python, '-c', 'import sys; print(*sys.version_info[:2])'],
+                            stdout=subprocess.PIPE, universal_newlines=True, check=True).stdout
+    return tuple(int(part) for part in output.split())
+
+
+def precompile(entries, virtualenv, workdir, keep=(), runtime=None, log=print):
+    python = os.path.join(virtualenv.rstrip('/'), 'bin', 'python') if virtualenv else sys.executable
+    version = interpreter_version(python)
+    if version != runtime_version(runtime):
+        # a .pyc only loads on the python version that wrote it
+        log('Not precompiling, {} is python {} but the runtime is {}.'.format(
+            python, '.'.join(str(part) for part in version), runtime))
+        return entries
+    jobs, compiled = [], []
+    for arcname, path in entries:
+        if arcname.endswith('.py') and arcname not in keep:
+            target = os.path.join(workdir, 'pyc', arcname + 'c')
+            os.makedirs(os.path.dirname(target), exist_ok=True)
+            jobs.append([path, target])
+            compiled.append((arcname + 'c', target))
+        else:
+            compiled.append((arcname, path))
+    if jobs:
+        subprocess.run([python, '-c', _COMPILE_SCRIPT], input=json.dumps(jobs),
+                       universal_newlines=True, check=True)
+    return compiled
+
+
+def strip_binaries(entries, workdir):
+    strip = shutil.which('strip')
+    if not strip:
+        return entries
+    stripped = []
+    for arcname, path in entries:
+        if arcname.endswith('.so') or '.so.' in arcname.rsplit('/', 1)[-1]:
+            target = os.path.join(workdir, 'so', arcname)
+            os.makedirs(os.path.dirname(target), exist_ok=True)
+            shutil.copy2(path, target)
+            if subprocess.run([strip, '--strip-unneeded', target]).returncode == 0:
+                path = target
+        stripped.append((arcname, path))
+    return stripped
+
+
+def slim(entries, config, virtualenv, workdir, keep=(), runtime=None, log=print):
+    entries = exclude_entries(entries, config, keep=keep)
+    if config.get('stripBinaries'):
+        entries = strip_binaries(entries, workdir)
+    if config.get('precompile'):
+        entries = precompile(entries, virtualenv, workdir, keep=keep, runtime=runtime, log=log)
+    return entries
+
+
+def entries_size(entries):
+    return sum(os.path.getsize(path) for arcname, path in entries)
+
+
+def size_report(name, before, after, zip_file):
+    mb = 1024.0 * 1024.0
+    return '{}: {} files {:.2f} MB -> {} files {:.2f} MB, zip {:.2f} MB'.format(
+        name, len(before), entries_size(before) / mb, len(after), entries_size(after) / mb,
+        os.path.getsize(zip_file) / mb)
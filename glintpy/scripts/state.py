@@ -0,0 +1,137 @@
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from .batching import chunks
+
+CREATE = 'create'
+UPDATE = 'update'
+UNCHANGED = 'unchanged'
+
+SYMBOLS = {CREATE: '+', UPDATE: '~', UNCHANGED: '='}
+
+Change = namedtuple('Change', ['action', 'kind', 'name', 'detail'])
+
+
+def print_plan(changes):
+    for change in changes:
+        print('{} {} {}{}'.format(SYMBOLS[change.action], change.kind, change.name,
+                                  ' ({})'.format(change.detail) if change.detail else ''))
+    counts = {action: len([change for change in changes if change.action == action]) for action in SYMBOLS}
+    print('Plan: {} to create, {} to update, {} unchanged.'.format(counts[CREATE], counts[UPDATE],
+                                                                   counts[UNCHANGED]))
+
+
+def print_summary(title, results, outcomes):
+    # results are (name, outcome, error) with error set when that one failed
+    print('{} summary:'.format(title))
+    for name, outcome, error in results:
+        print('  {:<40} {}'.format(name, 'FAILED - ' + error if error else outcome.upper()))
+    counts = ['{} {}'.format(len([result for result in results if not result[2] and result[1] == outcome]), outcome)
+              for outcome in outcomes]
+    print(', '.join(counts + ['{} failed'.format(len([result for result in results if result[2]]))]) + '.')
+
+
+class StackState(object):
+    def __init__(self, clients, inventory):
+        self.clients = clients
+        self.inventory = inventory
+        self.policies = {}
+        self.roles = {}
+        self.db_subnet_groups = {}
+        self.db_instances = {}
+        self.alarms = {}
+        self.topics = {}
+        self.tables = {}
+
+    def load(self, data, max_workers=8):
+        readers = [lambda: self.inventory.find('vpcs'),
+                   lambda: self.inventory.find('subnets'),
+                   lambda: self.inventory.find('securityGroups'),
+                   lambda: self.inventory.find('natGateways'),
+                   self._read_policies,
+                   self._read_roles,
+                   self._read_db_subnet_groups,
+                   self._read_db_instances,
+                   lambda: self._read_alarms([item.get('name') for item in data.get('cloudWatch', {}).get('alarms', [])]),
+                   self._read_topics,
+                   lambda: self._read_tables([item.get('name') for item in data.get('dynamoDBs', [])])]
+        with ThreadPoolExecutor(max_workers=max_workers) as pool:
+            for future in [pool.submit(reader) for reader in readers]:
+                future.result()
+        return self
+
+    def _paginate(self, service, operation, key, **kwargs):
+        for page in self.clients[service].get_paginator(operation).paginate(**kwargs):
+            for resource in page.get(key, []):
+                yield resource
+
+    def _read_policies(self):
+        self.policies = {policy.get('PolicyName'): policy
+                         for policy in self._paginate('iam', 'list_policies', 'Policies', Scope='Local')}
+
+    def _read_roles(self):
+        self.roles = {role.get('RoleName'): role for role in self._paginate('iam', 'list_roles', 'Roles')}
+
+    def _read_db_subnet_groups(self):
+        self.db_subnet_groups = {group.get('DBSubnetGroupName'): group
+                                 for group in self._paginate('rds', 'describe_db_subnet_groups', 'DBSubnetGroups')}
+
+    def _read_db_instances(self):
+        self.db_instances = {instance.get('DBInstanceIdentifier'): instance
+                             for instance in self._paginate('rds', 'describe_db_instances', 'DBInstances')}
+
+    def _read_alarms(self, names):
+        for chunk in chunks([name for name in names if name], 100):
+            for alarm in self._paginate('cloudwatch', 'describe_alarms', 'MetricAlarms', AlarmNames=chunk):
+                self.alarms[alarm.get('AlarmName')] = alarm
+
+    def _read_topics(self):
+        self.topics = {topic.get('TopicArn').split(':')[-1]: topic.get('TopicArn')
+                       for topic in self._paginate('sns', 'list_topics', 'Topics')}
+
+    def _read_tables(self, names):
+        existing = set(self._paginate('dynamodb', 'list_tables', 'TableNames'))
+        for name in names:
+            if name in existing:
+                self.tables[name] = self.clients['dynamodb'].describe_table(TableName=name).get('Table')
+
+    def vpc_id(self, item):
+        for vpc in self.inventory.find('vpcs'):
+            if (item.get('defaultVpc') and vpc.get('IsDefault')) or \
+               (not item.get('defaultVpc') and vpc.get('CidrBlock') == item.get('cidrBlock')):
+                return vpc.get('VpcId')
+        return None
+
+    def security_group_id(self, name, vpc_id):
+        groups = self.inventory.find('securityGroups', name=name, vpc=vpc_id)
+        return groups[0].get('GroupId') if groups else None
+
+    def nat_gateway(self, subnet_id):
+        for gateway in self.inventory.find('natGateways', subnet=subnet_id):
+            if gateway.get('State') in ('pending', 'available'):
+                return gateway
+        return None
+
+    def alarm_changes(self, params):
+        alarm = self.alarms.get(params.get('AlarmName'))
+        if alarm is None:
+            return None
+        changes = []
+        for key, value in params.items():
+            current = alarm.get(key)
+            if key == 'Dimensions':
+                current, value = sorted((d.get('Name'), d.get('Value')) for d in current or []), \
+                                 sorted((d.get('Name'), d.get('Value')) for d in value)
+            if current != value and not (current is None and value in ('', [])):
+                changes.append(key)
+        return changes
+
+    def table_changes(self, item):
+        table = self.tables.get(item.get('name'))
+        if table is None:
+            return None
+        current = table.get('ProvisionedThroughput', {})
+        wanted = item.get('provisionedThroughput', {})
+        if current.get('ReadCapacityUnits') != wanted.get('readCapacityUnits') or \
+           current.get('WriteCapacityUnits') != wanted.get('writeCapacityUnits'):
+            return ['provisionedThroughput']
+        return []
@@ -0,0 +1,78 @@
+import hashlib
+import json
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from .clients import ClientPool
+from .state import print_summary
+
+CREATED = 'created'
+UPDATED = 'updated'
+UNCHANGED = 'unchanged'
+
+
+class StateMachineError(ValueError):
+    def __init__(self, errors):
+        super().__init__('Invalid state machine:\n  ' + '\n  '.join(errors))
+        self.errors = errors
+
+
+def canonical_definition(definition):
+    if hasattr(definition, 'to_dict'):
+        definition = definition.to_dict()
+    elif isinstance(definition, str):
+        definition = json.loads(definition)
+    return json.dumps(definition, sort_keys=True, separators=(',', ':'))
+
+
+def definition_hash(definition):
+    return hashlib.sha256(canonical_definition(definition).encode('utf-8')).hexdigest()
+
+
+def existing_state_machines(client):
+    machines = {}
+    for page in client.get_paginator('list_state_machines').paginate():
+        for machine in page.get('stateMachines', []):
+            machines[machine.get('name')] = machine.get('stateMachineArn')
+    return machines
+
+
+def deploy_state_machine(client, name, machine, role_arn, arn=None):
+    errors = machine.validate() if hasattr(machine, 'validate') else []
+    if errors:
+        raise StateMachineError(errors)
+
+    if arn is None:
+        response = client.create_state_machine(name=name, definition=machine.to_json(), roleArn=role_arn)
+        return CREATED, response.get('stateMachineArn')
+
+    deployed = client.describe_state_machine(stateMachineArn=arn)
+    if definition_hash(deployed.get('definition')) == definition_hash(machine) and \
+       deployed.get('roleArn') == role_arn:
+        return UNCHANGED, arn
+
+    client.update_state_machine(stateMachineArn=arn, definition=machine.to_json(), roleArn=role_arn)
+    return UPDATED, arn
+
+
+def deploy_state_machines(machines, role_arn, client=None, region_name=None, jobs=8):
+    if client is None:
+        client = ClientPool.shared(region=region_name).client('stepfunctions')
+    existing = existing_state_machines(client)
+
+    results = {}
+    with ThreadPoolExecutor(max_workers=jobs) as pool:
+        futures = {pool.submit(deploy_state_machine, client, name, machine,
+                               role_arn.get(name) if isinstance(role_arn, dict) else role_arn,
+                               existing.get(name)): name
+                   for name, machine in machines.items()}
+        for future in as_completed(futures):
+            name = futures[future]
+            try:
+                results[name] = future.result()
+            except Exception as e:
+                results[name] = ('failed', '{}: {}'.format(type(e).__name__, e))
+
+    summary = [(name, action, detail if action == 'failed' else None)
+               for name, (action, detail) in sorted(results.items())]
+    print_summary('State machine', summary, [CREATED, UPDATED, UNCHANGED])
+    return results
+
@@ -0,0 +1,153 @@
+import functools
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+THROTTLE_CODES = {'Throttling', 'ThrottlingException', 'ThrottledException', 'RequestThrottledException',
+                  'TooManyRequestsException', 'ProvisionedThroughputExceededException', 'RequestLimitExceeded',
+                  'SlowDown', 'RequestThrottled', 'PriorRequestNotComplete', 'EC2ThrottledException',
+                  'BandwidthLimitExceeded', 'LimitExceededException'}
+
+
+class Tracer(object):
+    def __init__(self):
+        self.enabled = False
+        self.events = []
+        self.calls = []
+        self._lock = threading.Lock()
+
+    def reset(self, enabled=False):
+        with self._lock:
+            self.enabled = enabled
+            self.events = []
+            self.calls = []
+
+    def _add(self, name, category, start, seconds, args):
+        event = {'name': name, 'cat': category, 'ph': 'X', 'ts': int(start * 1e6), 'dur': int(seconds * 1e6),
+                 'pid': os.getpid(), 'tid': threading.get_ident(), 'args': args}
+        with self._lock:
+            self.events.append(event)
+
+    @contextmanager
+    def span(self, name, category='glint', **args):
+        if not self.enabled:
+            yield
+            return
+        start = time.time()
+        try:
+            yield
+        finally:
+            self._add(name, category, start, time.time() - start, args)
+
+    def record_call(self, service, operation, start, seconds, retries, throttles, error=None):
+        self._add('{}.{}'.format(service, operation), 'aws', start, seconds,
+                  {'retries': retries, 'throttles': throttles, 'error': error})
+        with self._lock:
+            self.calls.append((service, operation, seconds, retries, throttles, error))
+
+    def drain(self):
+        with self._lock:
+            events, self.events = self.events, []
+            calls, self.calls = self.calls, []
+        return events, calls
+
+    def merge(self, drained):
+        events, calls = drained or ([], [])
+        with self._lock:
+            self.events.extend(events)
+            self.calls.extend(calls)
+
+    def write_chrome_trace(self, path):
+        with self._lock:
+            events = list(self.events)
+        with open(path, 'w') as trace_file:
+            json.dump({'traceEvents': events, 'displayTimeUnit': 'ms'}, trace_file)
+
+    def print_summary(self, top=15):
+        with self._lock:
+            events = [event for event in self.events if event.get('cat') != 'aws']
+            calls = list(self.calls)
+
+        print('Slowest steps:')
+        print('  {:<50} {:>10} {:<10}'.format('Step', 'Seconds', 'Category'))
+        for event in sorted(events, key=lambda event: -event['dur'])[:top]:
+            print('  {:<50} {:>10.2f} {:<10}'.format(event['name'][:50], event['dur'] / 1e6, event['cat']))
+
+        operations = {}
+        for service, operation, seconds, retries, throttles, error in calls:
+            count, total, slowest, retried, throttled, failed = operations.get((service, operation), (0, 0, 0, 0, 0, 0))
+            operations[(service, operation)] = (count + 1, total + seconds, max(slowest, seconds),
+                                                retried + retries, throttled + throttles, failed + bool(error))
+        print('AWS calls by total latency:')
+        print('  {:<40} {:>6} {:>9} {:>9} {:>8} {:>9} {:>7}'.format('Operation', 'Calls', 'Total s', 'Max s',
+                                                                     'Retries', 'Throttles', 'Errors'))
+        for (service, operation), (count, total, slowest, retried, throttled, failed) in \
+                sorted(operations.items(), key=lambda item: -item[1][1])[:top]:
+            print('  {:<40} {:>6} {:>9.2f} {:>9.2f} {:>8} {:>9} {:>7}'.format(
+                '{}.{}'.format(service, operation)[:40], count, total, slowest, retried, throttled, failed))
+        print('{} AWS calls, {:.1f}s of API latency, {} retries, {} throttled.'.format(
+            len(calls), sum(call[2] for call in calls), sum(call[3] for call in calls),
+            sum(call[4] for call in calls)))
+
+
+tracer = Tracer()
+
+
+def span(name, category='glint', **args):
+    return tracer.span(name, category, **args)
+
+
+def traced(name, category='phase'):
+    def decorator(fn):
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            with tracer.span(name, category):
+                return fn(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def _before_call(model, context, **kwargs):
+    if tracer.enabled:
+        context['glint_trace'] = {'service': model.service_model.service_name, 'operation': model.name,
+                                  'start': time.time(), 'attempts': 0, 'throttles': 0}
+
+
+def _needs_retry(request_dict=None, response=None, caught_exception=None, **kwargs):
+    trace = ((request_dict or {}).get('context') or {}).get('glint_trace')
+    if trace is None:
+        return None
+    trace['attempts'] += 1
+    code = response[1].get('Error', {}).get('Code') if response and response[1] else None
+    if code in THROTTLE_CODES:
+        trace['throttles'] += 1
+    return None
+
+
+def _finish(context, error=None, retries=None):
+    trace = context.pop('glint_trace', None) if context else None
+    if trace is None:
+        return
+    if retries is None:
+        retries = max(trace['attempts'] - 1, 0)
+    tracer.record_call(trace['service'], trace['operation'], trace['start'],
+                       time.time() - trace['start'], retries, trace['throttles'], error)
+
+
+def _after_call(parsed, context, **kwargs):
+    _finish(context, error=(parsed or {}).get('Error', {}).get('Code'),
+            retries=(parsed or {}).get('ResponseMetadata', {}).get('RetryAttempts'))
+
+
+def _after_call_error(exception, context, **kwargs):
+    # botocore passes no model with after-call-error
+    _finish(context, error=type(exception).__name__)
+
+
+def instrument(events):
+    events.register('before-call.*.*', _before_call, unique_id='glint-trace-before')
+    events.register('needs-retry.*.*', _needs_retry, unique_id='glint-trace-retry')
+    events.register('after-call.*.*', _after_call, unique_id='glint-trace-after')
+    events.register('after-call-error.*.*', _after_call_error, unique_id='glint-trace-error')
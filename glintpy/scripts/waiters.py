@@ -0,0 +1,183 @@
+import threading
+import time
+from concurrent.futures import Future
+from .batching import chunks
+from .tracing import span
+
+READY = 'ready'
+PENDING = 'pending'
+FAILED = 'failed'
+
+# seconds, per resource kind
+DEFAULT_SETTINGS = {'rds': {'minDelay': 10, 'maxDelay': 60, 'timeout': 3600},
+                    'nat': {'minDelay': 5, 'maxDelay': 30, 'timeout': 900},
+                    'es': {'minDelay': 20, 'maxDelay': 60, 'timeout': 3600},
+                    'lambda': {'minDelay': 1, 'maxDelay': 10, 'timeout': 300},
+                    'dynamodb': {'minDelay': 2, 'maxDelay': 20, 'timeout': 900}}
+BACKOFF = 1.5
+
+
+def check_rds(client, ids):
+    states = {}
+    for chunk in chunks(ids, 100):
+        paginator = client.get_paginator('describe_db_instances')
+        for page in paginator.paginate(Filters=[{'Name': 'db-instance-id', 'Values': chunk}]):
+            for instance in page.get('DBInstances', []):
+                status = instance.get('DBInstanceStatus')
+                if status == 'available' and instance.get('Endpoint'):
+                    states[instance.get('DBInstanceIdentifier')] = (READY, instance.get('Endpoint').get('Address'))
+                elif status in ('failed', 'incompatible-parameters', 'incompatible-network',
+                                'incompatible-restore', 'storage-full', 'deleting'):
+                    states[instance.get('DBInstanceIdentifier')] = (FAILED, status)
+    return states
+
+
+def check_nat(client, ids):
+    states = {}
+    paginator = client.get_paginator('describe_nat_gateways')
+    for page in paginator.paginate(NatGatewayIds=ids):
+        for gateway in page.get('NatGateways', []):
+            if gateway.get('State') == 'available':
+                states[gateway.get('NatGatewayId')] = (READY, gateway)
+            elif gateway.get('State') in ('failed', 'deleting', 'deleted'):
+                states[gateway.get('NatGatewayId')] = (FAILED, gateway.get('FailureMessage', gateway.get('State')))
+    return states
+
+
+def check_es(client, ids):
+    states = {}
+    for chunk in chunks(ids, 5):
+        for domain in client.describe_elasticsearch_domains(DomainNames=chunk).get('DomainStatusList', []):
+            endpoint = domain.get('Endpoint') or (domain.get('Endpoints') or {}).get('vpc')
+            if domain.get('Deleted'):
+                states[domain.get('DomainName')] = (FAILED, 'deleted')
+            elif not domain.get('Processing') and endpoint:
+                states[domain.get('DomainName')] = (READY, endpoint)
+    return states
+
+
+def check_lambda(client, ids):
+    # lambda has no batched describe that reports state, so ask per function
+    states = {}
+    for name in ids:
+        config = client.get_function_configuration(FunctionName=name)
+        if config.get('State') == 'Failed' or config.get('LastUpdateStatus') == 'Failed':
+            states[name] = (FAILED, config.get('StateReason') or config.get('LastUpdateStatusReason'))
+        elif config.get('State', 'Active') == 'Active' and config.get('LastUpdateStatus', 'Successful') == 'Successful':
+            states[name] = (READY, config)
+    return states
+
+
+def check_dynamodb(client, ids):
+    states = {}
+    for name in ids:
+        table = client.describe_table(TableName=name).get('Table')
+        indexes = table.get('GlobalSecondaryIndexes', [])
+        if table.get('TableStatus') == 'ACTIVE' and all(index.get('IndexStatus') == 'ACTIVE' for index in indexes):
+            states[name] = (READY, table)
+        elif table.get('TableStatus') in ('DELETING', 'INACCESSIBLE_ENCRYPTION_CREDENTIALS'):
+            states[name] = (FAILED, table.get('TableStatus'))
+    return states
+
+
+CHECKERS = {'rds': check_rds, 'nat': check_nat, 'es': check_es, 'lambda': check_lambda,
+            'dynamodb': check_dynamodb}
+
+
+class WaiterHub(object):
+    def __init__(self, clients, settings=None):
+        self.clients = clients
+        self.settings = {}
+        for kind, defaults in DEFAULT_SETTINGS.items():
+            self.settings[kind] = dict(defaults, **(settings or {}).get(kind, {}))
+        self._pending = {kind: {} for kind in CHECKERS}
+        self._delay = {kind: self.settings[kind]['minDelay'] for kind in CHECKERS}
+        self._next_poll = {kind: 0 for kind in CHECKERS}
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._stopped = False
+        self._thread = None
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *args):
+        self.stop()
+
+    def start(self):
+        if not self._thread:
+            self._thread = threading.Thread(target=self._run, name='glint-waiters', daemon=True)
+            self._thread.start()
+        return self
+
+    def stop(self):
+        self._stopped = True
+        self._wakeup.set()
+        if self._thread:
+            self._thread.join()
+            self._thread = None
+
+    def watch(self, kind, resource_id, timeout=None):
+        future = Future()
+        timeout = timeout or self.settings[kind]['timeout']
+        with self._lock:
+            if not self._pending[kind]:
+                # first resource of its kind in a while, give it a full delay before polling
+                self._delay[kind] = self.settings[kind]['minDelay']
+                self._next_poll[kind] = time.time() + self._delay[kind]
+            self._pending[kind].setdefault(resource_id, []).append((future, time.time() + timeout))
+        self._wakeup.set()
+        return future
+
+    def wait(self, kind, resource_id, timeout=None):
+        with span('wait {} {}'.format(kind, resource_id), 'wait'):
+            return self.watch(kind, resource_id, timeout=timeout).result()
+
+    def _poll(self, kind):
+        with self._lock:
+            ids = list(self._pending[kind])
+        try:
+            states = CHECKERS[kind](self.clients[kind], ids)
+        except Exception as e:
+            print('Error. Unable to check {} readiness: {}'.format(kind, e))
+            states = {}
+
+        now = time.time()
+        changed = False
+        with self._lock:
+            for resource_id in ids:
+                status, value = states.get(resource_id, (PENDING, None))
+                waiting = self._pending[kind].get(resource_id, [])
+                for future, deadline in list(waiting):
+                    if status == READY:
+                        future.set_result(value)
+                    elif status == FAILED:
+                        future.set_exception(RuntimeError('{} {} failed: {}'.format(kind, resource_id, value)))
+                    elif now >= deadline:
+                        future.set_exception(TimeoutError('Timed out waiting for {} {}'.format(kind, resource_id)))
+                    else:
+                        continue
+                    waiting.remove((future, deadline))
+                    changed = True
+                if not waiting:
+                    self._pending[kind].pop(resource_id, None)
+
+            settings = self.settings[kind]
+            if changed:
+                self._delay[kind] = settings['minDelay']
+            else:
+                self._delay[kind] = min(self._delay[kind] * BACKOFF, settings['maxDelay'])
+            self._next_poll[kind] = now + self._delay[kind]
+
+    def _run(self):
+        while not self._stopped:
+            now = time.time()
+            with self._lock:
+                due = [kind for kind in CHECKERS if self._pending[kind] and self._next_poll[kind] <= now]
+                upcoming = [self._next_poll[kind] for kind in CHECKERS if self._pending[kind]]
+            for kind in due:
+                self._poll(kind)
+            if not due:
+                self._wakeup.wait(max(min(upcoming) - now, 0) if upcoming else None)
+                self._wakeup.clear()
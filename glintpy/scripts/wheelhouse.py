@@ -0,0 +1,72 @@
+import hashlib
+import json
+import os
+import shutil
+import subprocess
+import tempfile
+
+DEFAULT_WHEELHOUSE_PATH = '~/.glint/wheelhouse'
+
+
+def pip_command(virtualenv):
+    return os.path.join(virtualenv.rstrip('/'), 'bin', 'pip') if virtualenv else 'pip'
+
+
+def run_pip(virtualenv, args, log=print):
+    result = subprocess.run([pip_command(virtualenv)] + args,
+                            stdout=subprocess.PIPE,
+                            stderr=subprocess.STDOUT,
+                            universal_newlines=True)
+    log(result.stdout)
+    return result.returncode
+
+
+class Wheelhouse(object):
+    def __init__(self, path=DEFAULT_WHEELHOUSE_PATH, offline=False):
+        self.path = os.path.abspath(os.path.expanduser(path))
+        self.wheels = os.path.join(self.path, 'wheels')
+        self.trees = os.path.join(self.path, 'trees')
+        self.offline = offline
+
+    @classmethod
+    def from_config(cls, data):
+        config = data.get('wheelhouse', {})
+        if config.get('enabled') is False:
+            return None
+        return cls(path=config.get('path', DEFAULT_WHEELHOUSE_PATH),
+                   offline=config.get('offline', False))
+
+    def key(self, packages, runtime, virtualenv):
+        return hashlib.sha256(json.dumps({'packages': sorted(packages),
+                                          'runtime': (runtime or '').lower(),
+                                          'virtualenv': virtualenv},
+                                         sort_keys=True).encode('utf-8')).hexdigest()
+
+    def install_tree(self, packages, runtime, virtualenv, log=print):
+        tree = os.path.join(self.trees, self.key(packages, runtime, virtualenv))
+        if os.path.isdir(tree):
+            log('Reusing resolved dependencies {}.'.format(' '.join(sorted(packages))))
+            return tree
+
+        os.makedirs(self.wheels, exist_ok=True)
+        os.makedirs(self.trees, exist_ok=True)
+
+        if not self.offline:
+            if run_pip(virtualenv, ['wheel', '-w', self.wheels,
+                                    '--find-links', self.wheels] + packages, log=log):
+                raise RuntimeError('Unable to build wheels for {}'.format(' '.join(packages)))
+
+        staging = tempfile.mkdtemp(dir=self.trees, suffix='.tmp')
+        try:
+            if run_pip(virtualenv, ['install', '--no-compile', '--no-index', '--find-links', self.wheels,
+                                    '-t', staging] + packages, log=log):
+                raise RuntimeError('Unable to install {} from the wheelhouse'.format(' '.join(packages)))
+            try:
+                os.rename(staging, tree)
+            except OSError:
+                # another worker finished the same dependency set first
+                if not os.path.isdir(tree):
+                    raise
+        finally:
+            shutil.rmtree(staging, ignore_errors=True)
+        return tree